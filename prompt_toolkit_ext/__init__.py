@@ -1,56 +1,46 @@
-import csv
-from argparse import ArgumentParser
-from io import StringIO
-from typing import List, Callable
-
-from prompt_toolkit.completion import Completer
-from prompt_toolkit.history import History
-from prompt_toolkit import prompt
-from prompt_toolkit.lexers import Lexer
-
-from .file_history import LimitSizeFileHistory
-from .arg_parser import PromptArgumentParser
-from .completer import PromptCompleter
-from .nested_completer import PromptNestedCompleter
-
-
-def run_prompt(prompt_parser: PromptArgumentParser,
-               prompt_history: History = None,
-               prompt_completer: Completer = None,
-               prompt_lexer: Lexer = None):
-
-    while True:
-
-        user_input = prompt('# ',
-                            history=prompt_history,
-                            completer=prompt_completer,
-                            lexer=prompt_lexer)
-
-        if len(user_input.strip()) == 0:
-            continue
-
-        lines = user_input.split('\n')
-
-        for line in lines:
-            if line is None or len(line.strip()) == 0:
-                continue
-            run_line(prompt_parser, line)
-
-
-def run_line(parser: PromptArgumentParser, line: str):
-    buff = StringIO(line)
-    reader = csv.reader(buff, delimiter=' ')
-    arg_array = None
-    for arg_array in reader:
-        pass
-    try:
-        parser.clear_error_flag()
-        args = parser.parse_args(arg_array)
-        if not parser.has_error_flag():
-            if hasattr(args, 'func'):
-                args.func(args)
-    except TypeError as e:
-        print(e)
+"""
+子模块在第一次使用时才导入，例如只使用 run_line 时不会导入 prompt_toolkit
+"""
+
+import importlib
+from typing import Callable
+
+
+# 名称 -> 定义它的子模块
+_LAZY_ATTRS = {
+    "LimitSizeFileHistory": "file_history",
+    "FramedFileHistory": "framed_history",
+    "DedupFileHistory": "dedup_history",
+    "PromptArgumentParser": "arg_parser",
+    "PromptCompleter": "completer",
+    "PromptNestedCompleter": "nested_completer",
+    "IndexedPromptSession": "search_index",
+    "Tokenizer": "tokenizer",
+    "BatchSummary": "batch",
+    "LineResult": "batch",
+    "iter_script": "batch",
+    "run_script": "batch",
+    "JobManager": "jobs",
+    "Instrumentation": "instrument",
+    "run_line": "runner",
+    "run_prompt": "prompt_loop",
+    "run_prompt_async": "prompt_loop",
+    "run_line_async": "prompt_loop",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module("." + module_name, __name__), name)
+    # 之后直接从模块字典中取得
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
 
 
 class ActionNotAllowedException(Exception):
@@ -65,10 +55,17 @@ class ActionNotAllowedException(Exception):
 
 __all__ = [
     "LimitSizeFileHistory",
+    "FramedFileHistory",
+    "DedupFileHistory",
+    "IndexedPromptSession",
     "PromptArgumentParser",
     "PromptCompleter",
     "PromptNestedCompleter",
+    "JobManager",
+    "Instrumentation",
+    "BatchSummary",
+    "LineResult",
+    "iter_script",
+    "run_script",
 ]
 
-
-
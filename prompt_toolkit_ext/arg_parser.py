@@ -1,58 +1,472 @@
 import argparse
+import copy
+import importlib
 import sys
+import threading
 from argparse import ArgumentParser, HelpFormatter
-from typing import Optional, Sequence, Type
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+
+def _prefix_range(sorted_keys: List[str], prefix: str) -> List[str]:
+    start = bisect_left(sorted_keys, prefix)
+    end = start
+    while end < len(sorted_keys) and sorted_keys[end].startswith(prefix):
+        end += 1
+    return sorted_keys[start:end]
+
+
+# 解析器树的版本号：任何 PromptArgumentParser 添加参数或子命令、延迟加载的子命令被创建时加 1。
+# 子解析器不知道自己的父解析器，所以使用一个全局的计数器，比较一个整数即可知道缓存是否过期
+_generation = 0
+
+
+def parser_generation() -> int:
+    return _generation
+
+
+def _bump_generation() -> None:
+    global _generation
+    _generation += 1
+
+
+def nargs_range(nargs) -> Tuple[int, Optional[int]]:
+    """
+    参数值的最少和最多个数，None 表示没有上限
+    """
+    if nargs is None:
+        return 1, 1
+    if nargs == argparse.OPTIONAL:
+        return 0, 1
+    if nargs in (argparse.ZERO_OR_MORE, argparse.REMAINDER):
+        return 0, None
+    if nargs in (argparse.ONE_OR_MORE, argparse.PARSER):
+        return 1, None
+    return nargs, nargs
+
+
+class ParserIndex:
+    """
+    一个解析器的子命令（含别名）和参数的索引，由 :meth:`PromptArgumentParser.get_index` 创建并缓存。
+
+    添加参数或子命令后 `_actions` 的长度或子命令表的大小会变化，索引随之失效。
+    """
+
+    def __init__(self, parser: argparse.ArgumentParser) -> None:
+        self.commands: Dict[str, argparse.ArgumentParser] = {}
+        self.command_help: Dict[str, str] = {}
+        self.options: Dict[str, argparse.Action] = {}
+        self.actions: List[argparse.Action] = []
+        # 有参数名的参数（不含位置参数），以及每个参数定义的顺序
+        self.option_actions: List[argparse.Action] = []
+        self.action_order: Dict[argparse.Action, int] = {}
+        # 子命令之前最多可以输入的位置参数个数，None 表示没有上限
+        self.positional_capacity: Optional[int] = 0
+        self._parser = parser
+        self._subparsers_actions: List[argparse._SubParsersAction] = []
+
+        for action in parser._actions:
+            if isinstance(action, argparse._SubParsersAction):
+                self._subparsers_actions.append(action)
+                parser_map = action._name_parser_map
+                # 别名与命令共用同一个解析器，使用命令的帮助信息
+                help_by_parser = {}
+                for choice_action in action._choices_actions:
+                    if choice_action.dest in parser_map:
+                        help_by_parser[id(parser_map[choice_action.dest])] = choice_action.help or ''
+                for command, subparser in parser_map.items():
+                    self.commands.setdefault(command, subparser)
+                    self.command_help.setdefault(command, help_by_parser.get(id(subparser), ''))
+            else:
+                self.action_order[action] = len(self.actions)
+                self.actions.append(action)
+                if action.option_strings:
+                    self.option_actions.append(action)
+                elif self.positional_capacity is not None:
+                    max_count = nargs_range(action.nargs)[1]
+                    self.positional_capacity = None if max_count is None else self.positional_capacity + max_count
+                for opt_str in action.option_strings:
+                    self.options.setdefault(opt_str, action)
+
+        self.sorted_commands = sorted(self.commands)
+        self.sorted_options = sorted(self.options)
+        self._key = self._make_key()
+
+    def _make_key(self) -> Tuple[int, int]:
+        return (len(self._parser._actions),
+                sum(len(action._name_parser_map) for action in self._subparsers_actions))
+
+    def is_valid(self) -> bool:
+        return self._key == self._make_key()
+
+    def match_commands(self, text: str, match_middle: bool = False) -> List[str]:
+        if match_middle:
+            return [c for c in self.sorted_commands if text in c]
+        return _prefix_range(self.sorted_commands, text)
+
+    def match_options(self, prefix: str) -> List[str]:
+        return _prefix_range(self.sorted_options, prefix)
+
+
+ParserFactory = Callable[[argparse.ArgumentParser], Optional[argparse.ArgumentParser]]
+
+
+def _load_factory(factory: Union[str, ParserFactory]) -> ParserFactory:
+    """
+    `factory` 可以是函数，或者 "模块:函数" 形式的字符串
+    """
+    if not isinstance(factory, str):
+        return factory
+    module_name, _, attr = factory.partition(':')
+    if not attr:
+        raise ValueError('parser factory must be "module:function": %r' % factory)
+    func = importlib.import_module(module_name)
+    for name in attr.split('.'):
+        func = getattr(func, name)
+    return func
+
+
+class LazyParser:
+    """
+    Placeholder for a subcommand parser that is built on first use.
+
+    It is stored in the subparsers action's parser map in place of the parser,
+    so listing commands and their help does not build it.
+    """
+
+    def __init__(self, action: 'LazySubParsersAction', name: str,
+                 factory: Union[str, ParserFactory], help: Optional[str], kwargs: dict) -> None:
+        self.name = name
+        self.factory = factory
+        self.help = help
+        self._action = action
+        self._kwargs = kwargs
+        self._parser: Optional[argparse.ArgumentParser] = None
+        self._lock = threading.Lock()
+
+    @property
+    def materialized(self) -> bool:
+        return self._parser is not None
+
+    def get_parser(self) -> argparse.ArgumentParser:
+        """
+        创建解析器（只创建一次），并在子命令表中用它替换占位对象
+        """
+        with self._lock:
+            if self._parser is None:
+                parser = self._action._parser_class(**self._kwargs)
+                # 工厂函数向创建好的解析器中添加参数，也可以返回一个新的解析器
+                ret = _load_factory(self.factory)(parser)
+                if isinstance(ret, argparse.ArgumentParser):
+                    parser = ret
+                parser_map = self._action._name_parser_map
+                for command, entry in list(parser_map.items()):
+                    if entry is self:
+                        parser_map[command] = parser
+                self._parser = parser
+                _bump_generation()
+            return self._parser
+
+
+def resolve_parser(entry):
+    """
+    子命令表中的值可能是 :class:`LazyParser`，返回实际的解析器
+    """
+    if isinstance(entry, LazyParser):
+        return entry.get_parser()
+    return entry
+
+
+class LazySubParsersAction(argparse._SubParsersAction):
+    """
+    Subparsers action that also accepts lazily built subcommands.
+    """
+
+    def add_lazy_parser(self, name: str, factory: Union[str, ParserFactory], **kwargs) -> LazyParser:
+        """
+        注册一个子命令，解析器在第一次被补全、高亮或执行时才通过 `factory` 创建。
+
+        `factory` 接收创建好的空解析器并向其中添加参数，也可以是 "模块:函数" 形式的字符串，
+        其他参数与 :meth:`add_parser` 相同
+        """
+        if kwargs.get('prog') is None:
+            kwargs['prog'] = '%s %s' % (self._prog_prefix, name)
+
+        aliases = kwargs.pop('aliases', ())
+
+        for command in (name,) + tuple(aliases):
+            if command in self._name_parser_map:
+                raise argparse.ArgumentError(self, 'conflicting subparser: %s' % command)
+
+        help = None
+        if 'help' in kwargs:
+            help = kwargs.pop('help')
+            self._choices_actions.append(self._ChoicesPseudoAction(name, aliases, help))
+
+        lazy_parser = LazyParser(self, name, factory, help, kwargs)
+        self._name_parser_map[name] = lazy_parser
+        for alias in aliases:
+            self._name_parser_map[alias] = lazy_parser
+        _bump_generation()
+        return lazy_parser
+
+    def add_parser(self, name, **kwargs):
+        parser = super(LazySubParsersAction, self).add_parser(name, **kwargs)
+        _bump_generation()
+        return parser
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values:
+            resolve_parser(self._name_parser_map.get(values[0]))
+        super(LazySubParsersAction, self).__call__(parser, namespace, values, option_string)
+
+
+# 试解析（dry_run）时会执行的类型转换，其他的 type（例如 FileType）不会被调用，参数值保持为字符串
+_SAFE_TYPES = (int, float, complex, str)
+
+# 试解析时会执行的 action：只把值保存到 namespace 中，或者继续解析子命令
+_SAFE_ACTION_CALLS = {cls.__call__ for cls in (
+    argparse._StoreAction, argparse._StoreConstAction, argparse._AppendAction, argparse._AppendConstAction,
+    argparse._CountAction, argparse._ExtendAction, argparse.BooleanOptionalAction,
+    argparse._HelpAction, argparse._VersionAction, argparse._SubParsersAction, LazySubParsersAction,
+)}
+
+
+class _DryRunAction(argparse.Action):
+    """
+    Stand-in for a custom action in a dry-run parser: consumes the same
+    values but does nothing with them.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        pass
+
+
+def _dry_run_action(action: argparse.Action) -> argparse.Action:
+    """
+    返回 `action` 用于试解析的副本，不修改原来的 action
+    """
+    if isinstance(action, argparse._SubParsersAction):
+        new_action = copy.copy(action)
+        new_action._name_parser_map = new_action.choices = _DryRunParserMap(action._name_parser_map)
+        return new_action
+    if type(action).__call__ in _SAFE_ACTION_CALLS:
+        new_action = copy.copy(action)
+    else:
+        new_action = _DryRunAction.__new__(_DryRunAction)
+        new_action.__dict__.update(action.__dict__)
+    if new_action.type is not None and new_action.type not in _SAFE_TYPES:
+        # 没有转换类型的值无法与 choices 比较
+        new_action.type = None
+        new_action.choices = None
+    return new_action
+
+
+def _dry_run_parser(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    if isinstance(parser, PromptArgumentParser):
+        return parser.get_dry_run_parser()
+    return parser
+
+
+class _DryRunParserMap(dict):
+    """
+    子命令表的副本，取出的解析器是试解析用的副本
+    """
+
+    def __getitem__(self, name):
+        return _dry_run_parser(resolve_parser(super(_DryRunParserMap, self).__getitem__(name)))
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+
+class _PromptArgumentGroup(argparse._ArgumentGroup):
+    """
+    Argument group whose arguments also bump the parser generation.
+    """
+
+    def _add_action(self, action):
+        action = super(_PromptArgumentGroup, self)._add_action(action)
+        _bump_generation()
+        return action
+
+
+class ParseContext:
+    """
+    一次 :meth:`PromptArgumentParser.parse_args` 的解析过程：经过的解析器（根解析器在前）、
+    是否出错，以及静默解析时记录的输出信息
+    """
+
+    def __init__(self, silent: bool = False) -> None:
+        self.path: List['PromptArgumentParser'] = []
+        self.has_error = False
+        self.silent = silent
+        self.messages: List[str] = []
+        # 第一个错误的信息
+        self.error: Optional[str] = None
+
+
+# 当前线程中正在进行的解析过程
+_local = threading.local()
 
 
 class PromptArgumentParser(argparse.ArgumentParser):
 
-    def parse_args(self, args=None, namespace=None):
-        ret = super(PromptArgumentParser, self).parse_args(args, namespace)
+    _index: Optional[ParserIndex] = None
+    # (parser_generation(), 试解析用的副本)
+    _dry_run: Optional[Tuple[int, 'PromptArgumentParser']] = None
+
+    def __init__(self, *args, **kwargs):
+        super(PromptArgumentParser, self).__init__(*args, **kwargs)
+        self.has_error = False
+        # 每个线程最近一次的解析过程
+        self._local = threading.local()
+        self.register('action', 'parsers', LazySubParsersAction)
+
+    def get_index(self) -> ParserIndex:
+        index = self._index
+        if index is None or not index.is_valid():
+            index = self._index = ParserIndex(self)
+        return index
+
+    def get_dry_run_parser(self) -> 'PromptArgumentParser':
+        """
+        试解析用的副本：参数都是副本，自定义的 action 不执行，除 int、float 等内置类型以外的
+        `type` 不会被调用。子命令的解析器在用到时才创建副本，解析器改变后重新创建
+        """
+        generation = parser_generation()
+        cached = self._dry_run
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+
+        shadow = copy.copy(self)
+        actions = {action: _dry_run_action(action) for action in self._actions}
+        shadow._actions = list(actions.values())
+        shadow._option_string_actions = {opt_str: actions.get(action, action)
+                                         for opt_str, action in self._option_string_actions.items()}
+        shadow._mutually_exclusive_groups = []
+        for group in self._mutually_exclusive_groups:
+            new_group = copy.copy(group)
+            new_group._group_actions = [actions.get(action, action) for action in group._group_actions]
+            shadow._mutually_exclusive_groups.append(new_group)
+        shadow._dry_run = (generation, shadow)
+        self._dry_run = (generation, shadow)
+        return shadow
+
+    def invalidate_index(self):
+        self._index = None
+        _bump_generation()
+
+    def _add_action(self, action):
+        action = super(PromptArgumentParser, self)._add_action(action)
+        _bump_generation()
+        return action
+
+    def add_argument_group(self, *args, **kwargs):
+        group = _PromptArgumentGroup(self, *args, **kwargs)
+        self._action_groups.append(group)
+        return group
+
+    def add_argument(self, *args, completer=None, **kwargs):
+        """
+        `completer` 用于补全参数值，可以是 :class:`Completer`，或者接收 (输入的值, action)
+        并返回候选值的函数
+        """
+        action = super(PromptArgumentParser, self).add_argument(*args, **kwargs)
+        action.completer = completer
+        return action
+
+    def parse_args(self, args=None, namespace=None, silent=False, dry_run=False):
+        """
+        `silent` 为 True 时不输出帮助和错误信息，而是记录在本次解析的 :class:`ParseContext` 中。
+
+        `dry_run` 为 True 时只检查输入：除 int、float 等内置类型以外的 `type`（例如
+        :class:`argparse.FileType`）不会被调用，参数值保持为字符串，也不检查其 choices；
+        自定义的 action 不会被执行。子命令的解析器不是 PromptArgumentParser 时不受此限制
+        """
+        if dry_run:
+            return self.get_dry_run_parser().parse_args(args, namespace, silent=silent)
+        context = ParseContext(silent)
+        previous = getattr(_local, 'context', None)
+        _local.context = context
+        try:
+            ret = super(PromptArgumentParser, self).parse_args(args, namespace)
+        finally:
+            _local.context = previous
+            for parser in context.path:
+                parser._local.last_context = context
+            self._local.last_context = context
         setattr(ret, 'prompt_args', args)
         setattr(ret, 'prompt_mode', True)
         return ret
 
+    def parse_known_args(self, args=None, namespace=None):
+        # 记录解析过程中经过的解析器（子命令的解析器也会调用这个方法）
+        context = getattr(_local, 'context', None)
+        if context is not None:
+            context.path.append(self)
+        return super(PromptArgumentParser, self).parse_known_args(args, namespace)
+
+    def get_parse_context(self) -> Optional['ParseContext']:
+        """
+        当前线程中最近一次经过该解析器的解析过程
+        """
+        return getattr(self._local, 'last_context', None)
+
+    def _print_message(self, message, file=None):
+        context = getattr(_local, 'context', None)
+        if context is not None and context.silent:
+            if message:
+                context.messages.append(message)
+            return
+        super(PromptArgumentParser, self)._print_message(message, file)
+
     def exit(self, status=0, message=None):
         if message:
             self._print_message(message, sys.stderr)
         self.has_error = True
+        context = getattr(_local, 'context', None)
+        if context is not None:
+            context.has_error = True
+            if status != 0 and context.error is None:
+                context.error = message
 
     def error(self, message):
         super(PromptArgumentParser, self).error(message)
         self.has_error = True
 
     def has_error_flag(self):
-
-        if not hasattr(self, 'has_error'):
-            self.has_error = False
-
-        if self.has_error:
-            return self.has_error
-
-        for sub_action in self._actions:
-            if isinstance(sub_action, argparse._SubParsersAction):
-                parser_map = sub_action._name_parser_map
-                for command, parser in parser_map.items():
-                    if isinstance(parser, PromptArgumentParser):
-                        if parser.has_error_flag():
-                            return True
-
-        return self.has_error
+        context = self.get_parse_context()
+        if context is not None:
+            return context.has_error
+        return getattr(self, 'has_error', False)
 
     def clear_error_flag(self):
+        # 只需要清除上一次解析经过的解析器
+        context = self.get_parse_context()
+        if context is not None:
+            for parser in context.path:
+                parser.has_error = False
+                parser._local.last_context = None
+            context.has_error = False
         self.has_error = False
-        for sub_action in self._actions:
-            if isinstance(sub_action, argparse._SubParsersAction):
-                parser_map = sub_action._name_parser_map
-                for command, parser in parser_map.items():
-                    if isinstance(parser, PromptArgumentParser):
-                        parser.clear_error_flag()
+        self._local.last_context = None
 
     def get_subparser_by_command(self, command, like=False):
         return PromptArgumentParser.get_subparser_by_command_(self, command, like)
 
     @staticmethod
     def get_subparser_by_command_(parent: argparse.ArgumentParser, command, like=False):
+        if isinstance(parent, PromptArgumentParser):
+            index = parent.get_index()
+            if like:
+                commands = index.match_commands(command, match_middle=True)
+                if len(commands) > 0:
+                    # 不创建延迟加载的解析器，未创建的子命令返回 LazyParser
+                    return {c: index.commands[c] for c in commands}
+                return None
+            return resolve_parser(index.commands.get(command))
+
         subparsers = {}
 
         for sub_action in parent._actions:
@@ -64,7 +478,7 @@ class PromptArgumentParser(argparse.ArgumentParser):
                 else:
                     parser_map = sub_action._name_parser_map
                     if parser_map.get(command):
-                        return parser_map.get(command)
+                        return resolve_parser(parser_map.get(command))
 
         if like:
             if len(subparsers) > 0:
@@ -81,18 +495,19 @@ class PromptArgumentParser(argparse.ArgumentParser):
                 "help_info": h
             }
 
-        for action in self._actions:
-            if isinstance(action, argparse.Action) and not isinstance(action, argparse._SubParsersAction):
-                opt_strings = action.option_strings
-                help_info = action.help
-                if opt in ['--', '-']:
-                    opt_list.append(get(opt_strings, help_info))
-                else:
-                    matched_opt_strings = []
-                    for opt_str in opt_strings:
-                        if opt_str.startswith(opt):
-                            matched_opt_strings.append(opt_str)
-                    opt_list.append(get(matched_opt_strings, help_info))
+        index = self.get_index()
+        if opt in ['--', '-']:
+            for action in index.option_actions:
+                opt_list.append(get(action.option_strings, action.help))
+            return opt_list
+
+        # 只对匹配的参数按定义的顺序排序
+        matched: Dict[argparse.Action, List[str]] = {}
+        for opt_str in index.match_options(opt):
+            matched.setdefault(index.options[opt_str], []).append(opt_str)
+        for action in sorted(matched, key=index.action_order.__getitem__):
+            matched_opt_strings = [o for o in action.option_strings if o in matched[action]]
+            opt_list.append(get(matched_opt_strings, action.help))
 
         return opt_list
 
@@ -106,6 +521,8 @@ class PromptArgumentParser(argparse.ArgumentParser):
 
     @staticmethod
     def get_help(parent, name: str):
+        if isinstance(parent, PromptArgumentParser):
+            return parent.get_index().command_help.get(name, '')
         if len(parent._actions) <= 1 :
             return ''
         actions = parent._actions[1]._choices_actions
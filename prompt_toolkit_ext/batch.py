@@ -0,0 +1,134 @@
+"""
+非交互地执行命令：从文件、管道或任意迭代器中逐行读取命令并执行，不会一次读入全部内容
+"""
+
+import time
+from typing import Callable, IO, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from prompt_toolkit_ext.arg_parser import PromptArgumentParser
+from prompt_toolkit_ext.tokenizer import Tokenizer
+
+
+# 以该字符开头的行视为注释
+COMMENT = '#'
+
+
+class LineResult(NamedTuple):
+    # 行号，从 1 开始
+    lineno: int
+    line: str
+    ok: bool
+    # 出错时的错误信息
+    error: Optional[str]
+    # 执行该行所用的时间（秒）
+    elapsed: float
+
+
+class BatchSummary:
+    """
+    Summary of a :func:`run_script` run.
+    """
+
+    def __init__(self, max_failures: int = 100) -> None:
+        # 执行的命令数，不包括空行和注释
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        # 空行和注释
+        self.skipped = 0
+        self.elapsed = 0.0
+        # 是否因为出错而提前停止
+        self.stopped = False
+        # 最先出错的 `max_failures` 行
+        self.failures: List[LineResult] = []
+        self.max_failures = max_failures
+
+    def add(self, result: LineResult) -> None:
+        self.total += 1
+        if result.ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            if len(self.failures) < self.max_failures:
+                self.failures.append(result)
+
+    @property
+    def throughput(self) -> float:
+        """
+        每秒执行的命令数
+        """
+        if self.elapsed <= 0:
+            return 0.0
+        return self.total / self.elapsed
+
+    def __str__(self) -> str:
+        text = '%d commands, %d succeeded, %d failed, %d skipped in %.3fs (%.1f commands/s)' % (
+            self.total, self.succeeded, self.failed, self.skipped, self.elapsed, self.throughput)
+        if self.stopped:
+            text += ', stopped on error'
+        return text
+
+
+def _execute(parser: PromptArgumentParser, tokenizer: Tokenizer, lineno: int, line: str,
+             silent: bool) -> LineResult:
+    start = time.perf_counter()
+    error = None
+    try:
+        args = parser.parse_args(tokenizer.split(line), silent=silent)
+        context = parser.get_parse_context()
+        if context is not None and context.has_error:
+            error = (context.error or 'parse error').strip()
+        elif hasattr(args, 'func'):
+            args.func(args)
+    except Exception as e:
+        # 批量执行时单个命令的异常不应中断整个脚本
+        error = '%s: %s' % (type(e).__name__, e)
+    return LineResult(lineno, line, error is None, error, time.perf_counter() - start)
+
+
+def iter_script(parser: PromptArgumentParser,
+                source: Union[IO[str], Iterable[str]],
+                stop_on_error: bool = False,
+                silent: bool = False,
+                summary: Optional[BatchSummary] = None) -> Iterator[LineResult]:
+    """
+    逐行执行 `source` 中的命令并返回每一行的结果，跳过空行和注释。
+
+    `stop_on_error` 为 True 时遇到第一个错误后停止；`silent` 为 True 时不输出 argparse 的
+    帮助和错误信息（错误信息仍记录在结果中）；传入 `summary` 时同时更新统计信息。
+    """
+    tokenizer = Tokenizer()
+    start = time.perf_counter()
+    try:
+        for lineno, line in enumerate(source, 1):
+            line = line.rstrip('\r\n')
+            if len(line.strip()) == 0 or line.lstrip().startswith(COMMENT):
+                if summary is not None:
+                    summary.skipped += 1
+                continue
+            result = _execute(parser, tokenizer, lineno, line, silent)
+            if summary is not None:
+                summary.add(result)
+            yield result
+            if stop_on_error and not result.ok:
+                if summary is not None:
+                    summary.stopped = True
+                return
+    finally:
+        if summary is not None:
+            summary.elapsed += time.perf_counter() - start
+
+
+def run_script(parser: PromptArgumentParser,
+               source: Union[IO[str], Iterable[str]],
+               stop_on_error: bool = False,
+               silent: bool = False,
+               on_result: Optional[Callable[[LineResult], None]] = None) -> BatchSummary:
+    """
+    执行 `source` 中的全部命令并返回统计信息，每一行执行完后调用 `on_result`
+    """
+    summary = BatchSummary()
+    for result in iter_script(parser, source, stop_on_error, silent, summary):
+        if on_result is not None:
+            on_result(result)
+    return summary
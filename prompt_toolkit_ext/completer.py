@@ -2,15 +2,102 @@ from prompt_toolkit.completion import WordCompleter, Completer
 from prompt_toolkit.document import Document
 from prompt_toolkit.completion import CompleteEvent
 from prompt_toolkit.completion import Completion
-from prompt_toolkit.formatted_text import HTML
-from prompt_toolkit.utils import get_cwidth
+from prompt_toolkit.formatted_text import FormattedText, StyleAndTextTuples
+
+from typing import AsyncGenerator, Callable, Dict, Iterable, List, Optional, Pattern, Tuple, Union
+
+import argparse
+import os
+from pathlib import PurePath
+
+from prompt_toolkit_ext.arg_parser import PromptArgumentParser, nargs_range
+from prompt_toolkit_ext.fuzzy import FuzzyMatcher
+from prompt_toolkit_ext.search_index import WordIndex
+from prompt_toolkit_ext.tokenizer import Tokenizer
+from prompt_toolkit_ext.word_provider import CachedWordsProvider
+from prompt_toolkit_ext.utils import DisplayCache, LRUCache
+
+
+# 通过 choices 或补全函数补全参数值时最多返回的数量
+MAX_VALUE_COMPLETIONS = 1000
+# 模糊匹配且没有指定 max_results 时最多返回的数量
+FUZZY_MAX_RESULTS = 100
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _is_path_type(value_type) -> bool:
+    if isinstance(value_type, argparse.FileType):
+        return True
+    return isinstance(value_type, type) and issubclass(value_type, (os.PathLike, PurePath))
+
+
+def _get_value_hint(action: argparse.Action) -> str:
+    hint = action.metavar
+    if hint is None and isinstance(action.type, type):
+        hint = action.type.__name__
+    if hint is None or isinstance(hint, tuple):
+        return '<input option value>'
+    return '<input option value: %s>' % hint
+
+
+class CachedPathCompleter(Completer):
+    """
+    Completer for file system paths. Directory listings are cached and only
+    read again when the modification time of the directory changes.
+    """
+
+    def __init__(self, only_directories: bool = False, expanduser: bool = True, maxsize: int = 256) -> None:
+        self.only_directories = only_directories
+        self.expanduser = expanduser
+        self._listings = LRUCache(maxsize)
+
+    def list_directory(self, directory: str) -> List[Tuple[str, bool]]:
+        """
+        返回目录中的 (名称, 是否为目录)，按名称排序
+        """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+        cached = self._listings.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        entries = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry.name, is_dir))
+        except OSError:
+            return []
+        entries.sort()
+        self._listings[directory] = (mtime, entries)
+        return entries
 
-from typing import Callable, Dict, Iterable, List, Optional, Pattern, Union
-
-import csv
-from io import StringIO
-from prompt_toolkit_ext import PromptArgumentParser
-from prompt_toolkit_ext.utils import fill_right
+    def get_completions(
+        self, document: Document, complete_event: CompleteEvent
+    ) -> Iterable[Completion]:
+        text = document.text_before_cursor
+        path = os.path.expanduser(text) if self.expanduser else text
+        dirname, prefix = os.path.split(path)
+
+        for name, is_dir in self.list_directory(dirname or os.curdir):
+            if not name.startswith(prefix):
+                continue
+            # 没有输入 . 时不显示隐藏文件
+            if name.startswith('.') and not prefix.startswith('.'):
+                continue
+            if self.only_directories and not is_dir:
+                continue
+            display = name + os.sep if is_dir else name
+            yield Completion(display, -len(prefix), display=display)
 
 
 class ArgParserCompleter(Completer):
@@ -25,6 +112,9 @@ class ArgParserCompleter(Completer):
         self.parser = parser
         self.ignore_case = ignore_case
         self.match_middle = match_middle
+        self.tokenizer = Tokenizer()
+        self.display_cache = DisplayCache()
+        self.path_completer = CachedPathCompleter()
 
     def get_completions(
         self, document: Document, complete_event: CompleteEvent
@@ -35,19 +125,16 @@ class ArgParserCompleter(Completer):
         word_before_cursor = document.get_word_before_cursor()
         text = document.text_before_cursor.lstrip()
 
-        if self.ignore_case:
-            text = text.lower()
+        tokens = self.tokenizer.tokenize(text)
 
-        buff = StringIO(text)
-        reader = csv.reader(buff, delimiter=' ')
-        args = None
-        for line in reader:
-            args = line
-            break
-
-        if args is None or len(args) == 0:
+        if len(tokens) == 0:
             return
 
+        args = [token.value for token in tokens]
+
+        if self.ignore_case:
+            args = [arg.lower() for arg in args]
+
         def remove_parent_args(args, parser):
             cur_cmd_pos = -1
             cur_parser = parser
@@ -75,33 +162,29 @@ class ArgParserCompleter(Completer):
 
         # 可能是命令
         if len(current_args) == 1:
-            subparsers = current_parser.get_subparser_by_command(command, like=True)
-            if subparsers is not None:
-                info_list: List[Dict[str, str]] = list()
+            index = current_parser.get_index()
+            commands = index.match_commands(command, self.match_middle)
+            if len(commands) > 0:
                 max_text_width = 7
-                for c, a in subparsers.items():
-                    help_msg = ''
-                    if isinstance(a, PromptArgumentParser):
-                        help_msg = PromptArgumentParser.get_help(current_parser, c)
-                        if len(help_msg) > max_text_width:
-                            max_text_width = len(help_msg)
-                    info_dict = {
-                        'text': c,
-                        'help': help_msg
-                    }
-                    info_list.append(info_dict)
-                for info in info_list:
-                    display = fill_right(info['text'], max_text_width) + ' ' + info['help']
-                    yield Completion(info['text'], -len(word_before_cursor), display=display, style='fg:blue',
+                for c in commands:
+                    help_msg = index.command_help.get(c, '')
+                    if len(help_msg) > max_text_width:
+                        max_text_width = len(help_msg)
+                for c in commands:
+                    display = self._get_display(c, index.command_help.get(c, ''), max_text_width)
+                    yield Completion(c, -len(word_before_cursor), display=display, style='fg:blue',
                                      selected_style="fg:white bg:blue")
 
 
-        # 检查上一次值，如果为参数则提示输入值
+        # 检查之前的参数，如果当前位置是参数值则补全参数值
         cur_text = current_args[-1]
-        if len(current_args) > 1:
-            last_text = current_args[-2]
-            if last_text.startswith('-'):
-                yield Completion('', -len(word_before_cursor), '<input option value>')
+        value_action, value_required = self._get_value_action(current_parser, current_args)
+        if value_action is not None:
+            # 替换整个参数（包含引号）
+            start_position = tokens[-1].start - len(text)
+            yield from self._get_value_completions(value_action, tokens[-1].value, start_position, complete_event)
+            if value_required:
+                return
 
         # 获得已经使用过的参数，避免重复出现
         exists_opts = []
@@ -109,9 +192,6 @@ class ArgParserCompleter(Completer):
             if arg.startswith('-'):
                 exists_opts.append(arg)
 
-        # TODO 判断路径，返回PathCompleter
-        # TODO 判断参数类型，显示提示
-
         # 获取所有可用的参数
         opt_groups = current_parser.get_parser_opts(cur_text)
         completions_dict = []
@@ -119,10 +199,10 @@ class ArgParserCompleter(Completer):
         for opt_group in opt_groups:
 
             opt_strings = opt_group.get('opt_strings')
-            help_info = opt_group.get('help_info')
+            help_info = opt_group.get('help_info') or ''
             for opt in opt_strings:
                 if opt not in ['-h', '--help'] and opt not in exists_opts:
-                    text_width = get_cwidth(opt)
+                    text_width = self.display_cache.width(opt)
                     if text_width > max_text_width:
                         max_text_width = text_width
                     completions_dict.append({'text': opt, 'display': help_info})
@@ -131,48 +211,201 @@ class ArgParserCompleter(Completer):
 
         for c in completions_dict:
             text = c.get('text')
-            display = fill_right(text, max_text_width) + ' ' + c.get('display')
+            display = self._get_display(text, c.get('display'), max_text_width)
             yield Completion(text, -len(cur_text),
                              display=display,
                              style='fg:blue',
                              selected_style="fg:white bg:blue")
 
+    @staticmethod
+    def _get_value_action(parser: PromptArgumentParser, args: List[str]) -> Tuple[Optional[argparse.Action], bool]:
+        """
+        当前输入的是参数值时返回 (参数, 是否必须输入参数值)，否则返回 (None, False)
+        """
+        if args[-1].startswith('-'):
+            return None, False
+        index = parser.get_index()
+        values = 0
+        for arg in reversed(args[:-1]):
+            if arg.startswith('-'):
+                action = index.options.get(arg)
+                if action is None:
+                    return None, False
+                min_count, max_count = nargs_range(action.nargs)
+                if max_count is not None and values >= max_count:
+                    return None, False
+                return action, values < min_count
+            values += 1
+        return None, False
+
+    def _get_value_completions(
+        self, action: argparse.Action, value: str, start_position: int, complete_event: CompleteEvent
+    ) -> Iterable[Completion]:
+        completer = getattr(action, 'completer', None)
+        if completer is None and _is_path_type(action.type):
+            completer = self.path_completer
+
+        if isinstance(completer, Completer):
+            for c in completer.get_completions(Document(value), complete_event):
+                if ' ' in c.text or '"' in c.text:
+                    # 包含空格的值需要用引号括起来，替换整个参数
+                    new_value = value[:len(value) + c.start_position] + c.text
+                    c = Completion(_quote(new_value), start_position, display=c.display,
+                                   style=c.style, selected_style=c.selected_style)
+                yield c
+            return
+
+        if completer is not None:
+            candidates = completer(value, action)
+        elif action.choices is not None:
+            candidates = action.choices
+        else:
+            yield Completion('', 0, display=_get_value_hint(action))
+            return
+
+        prefix = value.lower() if self.ignore_case else value
+        count = 0
+        for candidate in candidates:
+            candidate = str(candidate)
+            match = candidate.lower() if self.ignore_case else candidate
+            if not match.startswith(prefix):
+                continue
+            # 限制的是匹配的数量，而不是检查的候选值数量
+            if count >= MAX_VALUE_COMPLETIONS:
+                return
+            count += 1
+            text = candidate
+            if ' ' in text or '"' in text:
+                text = _quote(text)
+            yield Completion(text, start_position, display=candidate,
+                             style='fg:blue', selected_style="fg:white bg:blue")
+
+    def _get_display(self, text: str, help_info: str, width: int) -> StyleAndTextTuples:
+        return self.display_cache.get(
+            (text, help_info, width),
+            lambda: FormattedText([('', self.display_cache.fill_right(text, width) + ' ' + help_info)]))
+
 
 class PromptCompleter(WordCompleter):
+    """
+    :class:`.WordCompleter` that shows the help text of each word.
+
+    With `fuzzy` enabled the words are matched as case insensitive
+    subsequences of the word before the cursor, ranked by a score and the
+    matched characters are highlighted. `max_results` limits the number of
+    completions; in fuzzy mode only the best `max_results` words (at most
+    :data:`FUZZY_MAX_RESULTS` when it is not given) are formatted.
+
+    `words` can also be a :class:`.CachedWordsProvider`. The cached words are
+    completed right away and, when they are stale, the words that arrive
+    after the refresh are added to the completions.
+    """
 
     def __init__(
             self,
-            words: Union[List[str], Callable[[], List[str]]],
+            words: Union[List[str], Callable[[], List[str]], CachedWordsProvider],
             ignore_case: bool = False,
             meta_dict: Optional[Dict[str, str]] = None,
             WORD: bool = False,
             sentence: bool = False,
             match_middle: bool = False,
             pattern: Optional[Pattern[str]] = None,
-            help_info=None
+            help_info=None,
+            fuzzy: bool = False,
+            max_results: Optional[int] = None,
     ) -> None:
-        super(PromptCompleter, self).__init__(words, ignore_case, meta_dict, WORD, sentence, match_middle, pattern)
+        super(PromptCompleter, self).__init__(words, ignore_case=ignore_case, meta_dict=meta_dict, WORD=WORD,
+                                              sentence=sentence, match_middle=match_middle, pattern=pattern)
         self.help_info = help_info
+        self.fuzzy = fuzzy
+        self.max_results = max_results
+        self._fuzzy_matcher: Optional[FuzzyMatcher] = None
+        self._word_index: Optional[WordIndex] = None
+        self.display_cache = DisplayCache()
 
     def set_help_info(self, help_info):
         self.help_info = help_info
+        self.display_cache.clear()
+
+    def _get_fuzzy_matcher(self, words: List[str]) -> FuzzyMatcher:
+        # 单词列表不变时复用预先计算的小写单词
+        matcher = self._fuzzy_matcher
+        if matcher is None or matcher.words is not words or len(matcher.lower_words) != len(words):
+            matcher = self._fuzzy_matcher = FuzzyMatcher(words)
+        return matcher
+
+    def _get_word_index(self, words: List[str]) -> WordIndex:
+        index = self._word_index
+        if (index is None or index.words is not words or len(index.words) != len(words)
+                or index.ignore_case != self.ignore_case):
+            index = self._word_index = WordIndex(words, self.ignore_case)
+        return index
+
+    def _get_help_text(self, word: str) -> str:
+        text = ''
+        if self.help_info:
+            if word in self.help_info:
+                try:
+                    text = self.help_info[word]['help']
+                except:
+                    # 忽略错误信息
+                    pass
+        return text
 
     def get_completions(
             self, document: Document, complete_event: CompleteEvent
     ) -> Iterable[Completion]:
+        word_before_cursor = self._get_word_before_cursor(document)
+
         # Get list of words.
         words = self.words
-        if callable(words):
+        if isinstance(words, CachedWordsProvider):
+            words = words.get_words(word_before_cursor)
+        elif callable(words):
             words = words()
 
+        yield from self._match_words(words, word_before_cursor)
+
+    async def get_completions_async(
+            self, document: Document, complete_event: CompleteEvent
+    ) -> AsyncGenerator[Completion, None]:
+        provider = self.words
+        if not isinstance(provider, CachedWordsProvider):
+            async for completion in super(PromptCompleter, self).get_completions_async(document, complete_event):
+                yield completion
+            return
+
+        word_before_cursor = self._get_word_before_cursor(document)
+
+        # 先返回缓存中的单词，缓存过期时再等待更新后的结果
+        words, fresh = provider.get_cached(word_before_cursor)
+        if words:
+            for completion in self._match_words(words, word_before_cursor):
+                yield completion
+        if fresh:
+            return
+
+        new_words = await provider.fetch(word_before_cursor)
+        if words:
+            old_words = set(words)
+            new_words = [w for w in new_words if w not in old_words]
+        for completion in self._match_words(new_words, word_before_cursor):
+            yield completion
+
+    def _get_word_before_cursor(self, document: Document) -> str:
         # Get word/text before cursor.
         if self.sentence:
-            word_before_cursor = document.text_before_cursor
+            return document.text_before_cursor
         else:
-            word_before_cursor = document.get_word_before_cursor(
+            return document.get_word_before_cursor(
                 WORD=self.WORD, pattern=self.pattern
             )
 
+    def _match_words(self, words: List[str], word_before_cursor: str) -> Iterable[Completion]:
+        if self.fuzzy:
+            yield from self._get_fuzzy_completions(words, word_before_cursor)
+            return
+
         if self.ignore_case:
             word_before_cursor = word_before_cursor.lower()
 
@@ -186,16 +419,35 @@ class PromptCompleter(WordCompleter):
             else:
                 return word.startswith(word_before_cursor)
 
-        for a in words:
-            if word_matches(a):
-                text = ''
-                if self.help_info:
-                    if a in self.help_info:
-                        try:
-                            text = self.help_info[a]['help']
-                        except:
-                            # 忽略错误信息
-                            pass
-                yield Completion(
-                    a, -len(word_before_cursor),
-                    display=HTML('<b>' + a + '</b>---' + text + ''))
+        if words is self.words and isinstance(words, list):
+            # 固定的单词列表，通过索引查找
+            index = self._get_word_index(words)
+            matched_words = [words[i] for i in index.match(word_before_cursor, self.match_middle)]
+        else:
+            matched_words = (a for a in words if word_matches(a))
+
+        for count, a in enumerate(matched_words):
+            if self.max_results is not None and count >= self.max_results:
+                break
+            yield Completion(a, -len(word_before_cursor), display=self._get_display(a))
+
+    def _get_display(self, word: str) -> StyleAndTextTuples:
+        text = self._get_help_text(word)
+        return self.display_cache.get(
+            (word, text),
+            lambda: FormattedText([('class:b', word), ('', '---' + text)]))
+
+    def _get_fuzzy_completions(self, words: List[str], word_before_cursor: str) -> Iterable[Completion]:
+        matcher = self._get_fuzzy_matcher(words)
+        k = FUZZY_MAX_RESULTS if self.max_results is None else self.max_results
+        for i, positions in matcher.top_k(word_before_cursor, k):
+            a = words[i]
+            matched = set(positions)
+            display: StyleAndTextTuples = []
+            for j, c in enumerate(a):
+                if j in matched:
+                    display.append(('class:fuzzymatch.inside.character bold', c))
+                else:
+                    display.append(('class:fuzzymatch.inside bold', c))
+            display.append(('', '---' + self._get_help_text(a)))
+            yield Completion(a, -len(word_before_cursor), display=display)
@@ -0,0 +1,227 @@
+"""
+去重的历史文件格式
+
+每一行为一条记录：最后使用时间<TAB>使用次数<TAB>命令，命令中的反斜杠、换行符会被转义。
+同一条命令以文件中最后出现的记录为准，压缩时每条命令只保留一条记录。
+
+不是这种格式的行（例如 :class:`.LimitSizeFileHistory` 保存的历史文件）也作为命令读入，
+使用次数为该命令出现的行数，最后使用时间取文件的修改时间，压缩时改写为这种格式。
+"""
+
+import heapq
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Tuple
+
+from prompt_toolkit_ext.file_history import LimitSizeFileHistory, reverse_lines
+from prompt_toolkit_ext.utils import file_lock
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+def _escape(command: str) -> str:
+    return command.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _unescape(text: str) -> str:
+    if "\\" not in text:
+        return text
+    chars = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text):
+            i += 1
+            c = {"n": "\n", "r": "\r"}.get(text[i], text[i])
+        chars.append(c)
+        i += 1
+    return "".join(chars)
+
+
+class HistoryRecord:
+
+    __slots__ = ("command", "count", "last_used")
+
+    def __init__(self, command: str, count: int = 1, last_used: Optional[float] = None) -> None:
+        self.command = command
+        self.count = count
+        self.last_used = time.time() if last_used is None else last_used
+
+    def frecency(self, now: Optional[float] = None) -> float:
+        """
+        使用次数按距上次使用的时间加权，最近使用过的命令权重更高
+        """
+        age = (time.time() if now is None else now) - self.last_used
+        if age < HOUR:
+            weight = 4.0
+        elif age < DAY:
+            weight = 2.0
+        elif age < WEEK:
+            weight = 0.5
+        else:
+            weight = 0.25
+        return self.count * weight
+
+    def to_line(self) -> str:
+        return "%.3f\t%d\t%s" % (self.last_used, self.count, _escape(self.command))
+
+    @classmethod
+    def from_line(cls, line: str) -> Optional["HistoryRecord"]:
+        parts = line.split("\t", 2)
+        if len(parts) != 3:
+            return None
+        try:
+            return cls(_unescape(parts[2]), int(parts[1]), float(parts[0]))
+        except ValueError:
+            return None
+
+
+class DedupFileHistory(LimitSizeFileHistory):
+    """
+    :class:`.LimitSizeFileHistory` that keeps one record per distinct command,
+    with its use count and the time it was last used.
+
+    `size` is the number of distinct commands that are loaded. The records
+    are kept in a dict ordered by last use, so storing a command that was
+    used before costs O(1). :meth:`ranked_strings` orders the commands by
+    frecency and can be passed to a completer as its `words`.
+    """
+
+    def __init__(self, filename: str, size: int,
+                 compact_threshold: Optional[int] = None,
+                 batch_size: int = 32,
+                 flush_interval: float = 2.0) -> None:
+        super(DedupFileHistory, self).__init__(filename, size,
+                                               compact_threshold=compact_threshold,
+                                               batch_size=batch_size,
+                                               flush_interval=flush_interval)
+        # Oldest first.
+        self.records: Dict[str, HistoryRecord] = OrderedDict()
+
+    def load_history_strings(self) -> Iterable[str]:
+        if not os.path.exists(self.filename):
+            return []
+
+        with file_lock(self.lock_filename), open(self.filename, "rb") as f:
+            records, need_compact = self._read_records(f)
+
+        self.records = OrderedDict((r.command, r) for r in reversed(records))
+
+        if need_compact:
+            self.compact_in_background()
+
+        # Newest items first.
+        return [r.command for r in records]
+
+    def _read_records(self, f) -> Tuple[List[HistoryRecord], bool]:
+        """
+        从文件末尾向前读取，返回最近使用的 `size` 条不同命令（最新的在前），以及文件是否超过了压缩阈值
+        """
+        records: List[HistoryRecord] = []
+        seen = set()
+        # 由其他格式的行生成的记录，同一条命令再次出现时累加使用次数
+        plain: Dict[str, HistoryRecord] = {}
+        count = 0
+        # 其他格式的行早于其后的记录，使用时间不晚于文件的修改时间和之后记录的使用时间
+        last_used = os.fstat(f.fileno()).st_mtime
+        for count, line_bytes in enumerate(reverse_lines(f, self.block_size), 1):
+            full = len(records) >= self.size
+            if full:
+                if count > self.compact_threshold:
+                    return records, True
+                if not plain:
+                    continue
+            line = line_bytes.decode("utf-8").rstrip("\r")
+            record = HistoryRecord.from_line(line)
+            if record is None:
+                command = line.strip()
+                if command in plain:
+                    plain[command].count += 1
+                    continue
+                # 之后的记录中的使用次数已经包含了之前的使用
+                if not command or command in seen or full:
+                    continue
+                record = plain[command] = HistoryRecord(command, 1, last_used)
+            last_used = min(last_used, record.last_used)
+            if not full and record.command not in seen:
+                seen.add(record.command)
+                records.append(record)
+        return records, count > self.compact_threshold
+
+    async def load(self) -> AsyncGenerator[str, None]:
+        if not self._loaded:
+            self.load_history_strings()
+            self._loaded = True
+
+        for command in list(reversed(self.records)):
+            yield command
+
+    def get_strings(self) -> List[str]:
+        return list(self.records)
+
+    def append_string(self, string: str) -> None:
+        self.store_string(string)
+
+    def store_string(self, string: str) -> None:
+        record = self.records.get(string)
+        if record is None:
+            record = HistoryRecord(string, 0)
+            self.records[string] = record
+        else:
+            self.records.move_to_end(string)
+        record.count += 1
+        record.last_used = time.time()
+
+        if len(self.records) > self.size:
+            self.records.popitem(last=False)
+
+        self._writer.append((record.to_line() + os.linesep).encode("utf-8"))
+
+    def search(self, text: str, ignore_case: bool = False) -> Iterable[str]:
+        if ignore_case:
+            text = text.lower()
+            return (c for c in reversed(self.records) if text in c.lower())
+        return (c for c in reversed(self.records) if text in c)
+
+    def ranked_strings(self, limit: Optional[int] = None) -> List[str]:
+        """
+        按 frecency 从高到低返回命令
+        """
+        now = time.time()
+        records = self.records.values()
+        if limit is None:
+            ranked = sorted(records, key=lambda r: r.frecency(now), reverse=True)
+        else:
+            ranked = heapq.nlargest(limit, records, key=lambda r: r.frecency(now))
+        return [r.command for r in ranked]
+
+    def compact(self) -> None:
+        """
+        每条命令只保留最后一条记录，写入临时文件后通过重命名原子替换历史文件
+        """
+        if not os.path.exists(self.filename):
+            return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with file_lock(self.lock_filename):
+            with open(self.filename, "rb") as f:
+                records, need_compact = self._read_records(f)
+            if not need_compact:
+                return
+            tmp_name = None
+            try:
+                fd, tmp_name = tempfile.mkstemp(prefix=".history-", dir=directory)
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write("".join(r.to_line() + os.linesep for r in reversed(records)).encode("utf-8"))
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                # 原文件已经关闭（Windows 上不能替换仍然打开的文件），替换时仍持有文件锁
+                os.replace(tmp_name, self.filename)
+            except OSError:
+                # 压缩失败时保留原文件
+                if tmp_name is not None and os.path.exists(tmp_name):
+                    os.remove(tmp_name)
@@ -1,43 +1,277 @@
 from prompt_toolkit.history import History
-from typing import Iterable, List
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+from io import BytesIO
+import atexit
 import os
+import tempfile
+import threading
+
+from prompt_toolkit_ext.search_index import HistorySearchIndex
+from prompt_toolkit_ext.utils import file_lock
+
+
+# 从文件末尾向前读取时每次读取的字节数
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+def reverse_line_offsets(f: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[int]:
+    """
+    从文件末尾开始按块向前读取，依次返回每一行的起始偏移量（最新的一行在前）。
+    文件末尾的换行符不会被当作一个新行的开始。
+    """
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    if pos == 0:
+        return
+
+    skip_trailing = True
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size)
+        end = len(block)
+        if skip_trailing:
+            skip_trailing = False
+            if block.endswith(b"\n"):
+                end -= 1
+        while True:
+            nl = block.rfind(b"\n", 0, end)
+            if nl < 0:
+                break
+            yield pos + nl + 1
+            end = nl
+
+    yield 0
+
+
+def reverse_lines(f: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    从文件末尾开始按块向前读取，依次返回每一行的内容（不包含换行符，最新的一行在前）
+    """
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    if pos == 0:
+        return
+
+    remainder = b""
+    skip_trailing = True
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size) + remainder
+        if skip_trailing:
+            skip_trailing = False
+            if block.endswith(b"\n"):
+                block = block[:-1]
+        lines = block.split(b"\n")
+        remainder = lines[0]
+        for i in range(len(lines) - 1, 0, -1):
+            yield lines[i]
+
+    yield remainder
+
+
+class BatchedHistoryWriter:
+    """
+    缓存待写入的数据，在数量达到 `batch_size`、距第一条缓存数据超过 `flush_interval` 秒
+    或进程退出时批量追加到文件。写入时持有 `lock_filename` 上的建议锁，多个进程同时写入
+    同一个历史文件时不会互相破坏。
+    """
+
+    def __init__(self, filename: str, lock_filename: str,
+                 batch_size: int = 32, flush_interval: float = 2.0) -> None:
+        self.filename = filename
+        self.lock_filename = lock_filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[bytes] = []
+        self._lock = threading.Lock()
+        # 取出缓存和写入文件期间一直持有，多个线程同时 flush 时按缓存的顺序追加
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    def append(self, data: bytes) -> None:
+        with self._lock:
+            self._pending.append(data)
+            count = len(self._pending)
+            if count < self.batch_size and self._timer is None and self.flush_interval > 0:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if count >= self.batch_size or self.flush_interval <= 0:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            with file_lock(self.lock_filename):
+                with open(self.filename, "ab") as f:
+                    f.write(b"".join(pending))
+
+    def close(self) -> None:
+        self.flush()
+        atexit.unregister(self.flush)
 
 
 class LimitSizeFileHistory(History):
     """
     :class:`.History` class that stores all strings in a file.
+
+    Only the last `size` lines are loaded. The file is read backwards from the
+    end, so the startup cost does not depend on the size of the file. When the
+    file holds more than `compact_threshold` lines (``2 * size`` by default),
+    it is compacted in a background thread by writing the last `size` lines to
+    a temporary file and renaming it over the original one.
+
+    New strings are written in batches by a :class:`BatchedHistoryWriter`
+    (see `batch_size` and `flush_interval`). Writing, loading and compaction
+    hold an advisory lock on ``filename + '.lock'``, so several processes can
+    share one history file.
+
+    With `search_index` enabled, loaded and stored strings are added to a
+    :class:`.HistorySearchIndex`, which :class:`.IndexedSearchBuffer` uses
+    for reverse search.
     """
 
-    def __init__(self, filename: str, size: int) -> None:
+    def __init__(self, filename: str, size: int,
+                 compact_threshold: Optional[int] = None,
+                 block_size: int = DEFAULT_BLOCK_SIZE,
+                 batch_size: int = 32,
+                 flush_interval: float = 2.0,
+                 search_index: bool = False) -> None:
         self.filename = filename
+        self.lock_filename = filename + ".lock"
         self.size = size
+        if compact_threshold is None:
+            compact_threshold = 2 * size
+        self.compact_threshold = max(compact_threshold, size)
+        self.block_size = block_size
+        self._compact_thread: Optional[threading.Thread] = None
+        self._writer = BatchedHistoryWriter(filename, self.lock_filename, batch_size, flush_interval)
+        self._use_search_index = search_index
+        self.search_index: Optional[HistorySearchIndex] = HistorySearchIndex() if search_index else None
         super(LimitSizeFileHistory, self).__init__()
 
     def load_history_strings(self) -> Iterable[str]:
         strings: List[str] = []
-        if os.path.exists(self.filename):
-            with open(self.filename, "rb") as f:
-                for line_bytes in f:
-                    line = line_bytes.decode("utf-8")
-                    strings.append(line.strip())
-
-        # 截取最后一段数据
-        strings = strings[-self.size:]
-        # 清除数据
-        with open(self.filename, "wb") as f:
-            pass
-
-        with open(self.filename, "ab") as f:
-            for s in strings:
-                self.write_string(s, f)
+        if not os.path.exists(self.filename):
+            return strings
+
+        with file_lock(self.lock_filename), open(self.filename, "rb") as f:
+            start, need_compact = self._find_tail(f)
+            f.seek(start)
+            data = f.read()
+
+        if self._use_search_index:
+            self.search_index = HistorySearchIndex()
+        for line_bytes in self._split_lines(data):
+            string = line_bytes.decode("utf-8").strip()
+            strings.append(string)
+            if self.search_index is not None:
+                self.search_index.add(string)
+
+        if need_compact:
+            self.compact_in_background()
 
         # Reverse the order, because newest items have to go first.
         return reversed(strings)
 
+    def _find_tail(self, f: BinaryIO):
+        """
+        返回最后 `size` 行的起始偏移量，以及文件是否超过了压缩阈值
+        """
+        start = 0
+        count = 0
+        for count, offset in enumerate(reverse_line_offsets(f, self.block_size), 1):
+            if count <= self.size:
+                start = offset
+            if count > self.compact_threshold:
+                return start, True
+        if count == 0:
+            f.seek(0, os.SEEK_END)
+            start = f.tell()
+        return start, False
+
+    @staticmethod
+    def _split_lines(data: bytes) -> List[bytes]:
+        if len(data) == 0:
+            return []
+        lines = data.split(b"\n")
+        if data.endswith(b"\n"):
+            lines.pop()
+        return lines
+
+    def compact_in_background(self) -> None:
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self.compact, daemon=True)
+        self._compact_thread.start()
+
+    def compact(self) -> None:
+        """
+        只保留最后 `size` 行，写入临时文件后通过重命名原子替换历史文件。
+        持有文件锁后重新定位，其他进程可能已经追加或压缩过该文件。
+        """
+        if not os.path.exists(self.filename):
+            return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with file_lock(self.lock_filename):
+            tmp_name = None
+            try:
+                with open(self.filename, "rb") as f:
+                    start, need_compact = self._find_tail(f)
+                    if not need_compact:
+                        return
+                    fd, tmp_name = tempfile.mkstemp(prefix=".history-", dir=directory)
+                    with os.fdopen(fd, "wb") as tmp:
+                        f.seek(start)
+                        while True:
+                            block = f.read(self.block_size)
+                            if not block:
+                                break
+                            tmp.write(block)
+                        tmp.flush()
+                        os.fsync(tmp.fileno())
+                # 关闭原文件后再替换（Windows 上不能替换仍然打开的文件），替换时仍持有文件锁
+                os.replace(tmp_name, self.filename)
+            except OSError:
+                # 压缩失败时保留原文件
+                if tmp_name is not None and os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+
+    def append_string(self, string: str) -> None:
+        super(LimitSizeFileHistory, self).append_string(string)
+        if self.search_index is not None:
+            self.search_index.add(string)
+
+    def search(self, text: str, ignore_case: bool = False) -> Iterable[str]:
+        """
+        按从新到旧的顺序返回包含 `text` 的历史记录
+        """
+        if self.search_index is not None:
+            return (self.search_index.strings[i] for i in self.search_index.search(text, ignore_case))
+        if ignore_case:
+            text = text.lower()
+            return (s for s in self._loaded_strings if text in s.lower())
+        return (s for s in self._loaded_strings if text in s)
+
     def store_string(self, string: str) -> None:
-        # Save to file.
-        with open(self.filename, "ab") as f:
-            self.write_string(string, f)
+        # Save to file (in batches).
+        buff = BytesIO()
+        self.write_string(string, buff)
+        self._writer.append(buff.getvalue())
+
+    def flush(self) -> None:
+        self._writer.flush()
 
     def write_string(self, string, f) -> None:
         def write(t: str) -> None:
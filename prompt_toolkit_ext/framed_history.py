@@ -0,0 +1,201 @@
+"""
+分帧存储的历史文件格式
+
+数据文件：文件头 MAGIC，之后每条记录为 4 字节小端长度 + utf-8 内容，多行命令作为一条记录保存。
+索引文件（数据文件名 + '.idx'）：每条记录在数据文件中的偏移量，8 字节小端无符号整数。
+
+先写数据再写索引，索引落后于数据时在加载时从最后一条有效索引开始向后扫描补齐。
+"""
+
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+
+from prompt_toolkit.history import History
+
+from prompt_toolkit_ext.utils import file_lock
+
+
+MAGIC = b"PTKHIST1"
+INDEX_SUFFIX = ".idx"
+
+_LENGTH = struct.Struct("<I")
+_OFFSET = struct.Struct("<Q")
+
+
+@contextmanager
+def _mmap_file(filename: str) -> Iterator[Optional[mmap.mmap]]:
+    """
+    以只读方式映射文件，文件不存在或为空时返回 None
+    """
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        yield None
+        return
+    with open(filename, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def _encode_record(string: str) -> bytes:
+    data = string.encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+class FramedFileHistory(History):
+    """
+    :class:`.History` class that stores length-prefixed records in a file,
+    with an offset index in a sidecar file.
+
+    Only the newest `size` entries are loaded and both files are read through
+    `mmap`, so the cost of loading and of :meth:`get_string` does not depend
+    on the size of the history file.
+
+    Writing and loading hold an advisory lock on ``filename + '.lock'``, so
+    several processes can share one history file.
+    """
+
+    def __init__(self, filename: str, size: int) -> None:
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        self.lock_filename = filename + ".lock"
+        self.size = size
+        super(FramedFileHistory, self).__init__()
+
+    def count(self) -> int:
+        """
+        索引中的记录数。只读取索引文件的大小，不修复索引（修复只在加载时进行），
+        因此写入中断后到下一次加载之前可能与实际记录数不同
+        """
+        if not os.path.exists(self.index_filename):
+            return 0
+        return os.path.getsize(self.index_filename) // _OFFSET.size
+
+    def load_history_strings(self) -> Iterable[str]:
+        strings: List[str] = []
+        with file_lock(self.lock_filename):
+            self._repair_index()
+            with _mmap_file(self.index_filename) as index, _mmap_file(self.filename) as data:
+                if index is None or data is None:
+                    return strings
+                count = len(index) // _OFFSET.size
+                # Newest items first.
+                for i in range(count - 1, max(count - self.size, 0) - 1, -1):
+                    strings.append(self._read_record(data, _OFFSET.unpack_from(index, i * _OFFSET.size)[0]))
+        return strings
+
+    def get_string(self, i: int) -> str:
+        """
+        按序号读取一条记录（0 为最早的记录，负数从最新的记录开始计算）
+        """
+        with _mmap_file(self.index_filename) as index, _mmap_file(self.filename) as data:
+            count = 0 if index is None else len(index) // _OFFSET.size
+            if i < 0:
+                i += count
+            if not 0 <= i < count:
+                raise IndexError("history index out of range")
+            return self._read_record(data, _OFFSET.unpack_from(index, i * _OFFSET.size)[0])
+
+    @staticmethod
+    def _read_record(data: mmap.mmap, offset: int) -> str:
+        length = _LENGTH.unpack_from(data, offset)[0]
+        start = offset + _LENGTH.size
+        return data[start:start + length].decode("utf-8")
+
+    def store_string(self, string: str) -> None:
+        # 数据和索引分两次写入，持有文件锁，其他进程不会在两次写入之间修复索引
+        with file_lock(self.lock_filename):
+            with open(self.filename, "ab") as f:
+                offset = self._ensure_header(f)
+                f.write(_encode_record(string))
+            with open(self.index_filename, "ab") as f:
+                f.write(_OFFSET.pack(offset))
+
+    @staticmethod
+    def _ensure_header(f: BinaryIO) -> int:
+        """
+        新文件写入文件头，返回下一条记录的偏移量
+        """
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            f.write(MAGIC)
+        return f.tell()
+
+    def _repair_index(self) -> None:
+        """
+        丢弃指向无效位置的索引，并为索引之后未编入索引的记录补齐索引，
+        数据文件末尾不完整的记录（写入中断）会被截掉。调用时需要持有文件锁，
+        否则可能截掉其他进程正在写入的记录
+        """
+        valid_end = None
+        with _mmap_file(self.filename) as data:
+            if data is None:
+                return
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError("%s is not a framed history file" % self.filename)
+            data_size = len(data)
+
+            with open(self.index_filename, "a+b") as index:
+                index.seek(0, os.SEEK_END)
+                index_size = index.tell()
+                count = index_size // _OFFSET.size
+                next_offset = len(MAGIC)
+                # 从后向前找到最后一条完整的记录
+                while count > 0:
+                    index.seek((count - 1) * _OFFSET.size)
+                    offset = _OFFSET.unpack(index.read(_OFFSET.size))[0]
+                    end = self._record_end(data, offset)
+                    if end is not None:
+                        next_offset = end
+                        break
+                    count -= 1
+
+                if index_size != count * _OFFSET.size:
+                    index.truncate(count * _OFFSET.size)
+
+                missing = []
+                while next_offset < data_size:
+                    end = self._record_end(data, next_offset)
+                    if end is None:
+                        break
+                    missing.append(_OFFSET.pack(next_offset))
+                    next_offset = end
+                if missing:
+                    index.seek(0, os.SEEK_END)
+                    index.write(b"".join(missing))
+
+            if next_offset < data_size:
+                valid_end = next_offset
+
+        if valid_end is not None:
+            with open(self.filename, "r+b") as f:
+                f.truncate(valid_end)
+
+    @staticmethod
+    def _record_end(data: mmap.mmap, offset: int) -> Optional[int]:
+        if offset < len(MAGIC) or offset + _LENGTH.size > len(data):
+            return None
+        end = offset + _LENGTH.size + _LENGTH.unpack_from(data, offset)[0]
+        if end > len(data):
+            return None
+        return end
+
+
+def convert_plain_history(source: str, target: str) -> int:
+    """
+    将 :class:`.LimitSizeFileHistory` 使用的文本格式转换为分帧格式，每一行作为一条记录，
+    返回写入的记录数
+    """
+    offsets = []
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        dst.write(MAGIC)
+        for line_bytes in src:
+            offsets.append(_OFFSET.pack(dst.tell()))
+            dst.write(_encode_record(line_bytes.decode("utf-8").strip()))
+    with open(target + INDEX_SUFFIX, "wb") as f:
+        f.write(b"".join(offsets))
+    return len(offsets)
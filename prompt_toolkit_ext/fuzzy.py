@@ -0,0 +1,107 @@
+"""
+模糊（子序列）匹配
+
+单词转为小写后按批拼接成以换行符分隔的字符串，查询时先用正则表达式在整批文本上查找包含
+子序列的单词，只对这些单词计算得分，再通过堆保留得分最高的 k 个结果。
+"""
+
+import heapq
+import re
+from bisect import bisect_right
+from typing import List, Optional, Sequence, Tuple
+
+
+BATCH_SIZE = 1024
+# 这些字符之后的字符视为单词的开头
+SEPARATORS = ' -_./:\\'
+
+_CONSECUTIVE_BONUS = 5
+_WORD_START_BONUS = 3
+_MAX_GAP_PENALTY = 3
+
+
+def fuzzy_match(query: str, word: str) -> Optional[Tuple[int, List[int]]]:
+    """
+    `query` 为 `word` 的子序列时返回 (得分, 匹配位置)，否则返回 None，两者都应为小写
+    """
+    positions: List[int] = []
+    score = 0
+    prev = -1
+    for c in query:
+        i = word.find(c, prev + 1)
+        if i < 0:
+            return None
+        score += 1
+        if i == prev + 1 and prev >= 0:
+            score += _CONSECUTIVE_BONUS
+        elif prev >= 0:
+            score -= min(i - prev - 1, _MAX_GAP_PENALTY)
+        if i == 0 or word[i - 1] in SEPARATORS:
+            score += _WORD_START_BONUS
+        positions.append(i)
+        prev = i
+    return score, positions
+
+
+class FuzzyMatcher:
+    """
+    对固定的单词列表做模糊匹配，只返回得分最高的结果
+    """
+
+    def __init__(self, words: Sequence[str], batch_size: int = BATCH_SIZE) -> None:
+        self.words = words
+        self.lower_words = [w.lower() for w in words]
+        # (拼接后的文本, 每个单词在文本中的起始位置, 第一个单词的序号)
+        self._batches: List[Tuple[str, List[int], int]] = []
+        for base in range(0, len(words), batch_size):
+            batch = self.lower_words[base:base + batch_size]
+            offsets = []
+            offset = 0
+            for w in batch:
+                offsets.append(offset)
+                offset += len(w) + 1
+            # 单词中的换行符替换为空格（长度不变），避免影响单词的定位
+            self._batches.append(('\n'.join(w.replace('\n', ' ') for w in batch), offsets, base))
+
+    def _candidates(self, query: str):
+        """
+        按顺序返回包含子序列 `query` 的单词序号
+        """
+        pattern = re.compile('[^\n]*?'.join(re.escape(c) for c in query))
+        for text, offsets, base in self._batches:
+            pos = 0
+            while True:
+                m = pattern.search(text, pos)
+                if m is None:
+                    break
+                i = bisect_right(offsets, m.start()) - 1
+                yield base + i
+                # 继续查找下一个单词
+                if i + 1 >= len(offsets):
+                    break
+                pos = offsets[i + 1]
+
+    def top_k(self, query: str, k: Optional[int] = None) -> List[Tuple[int, List[int]]]:
+        """
+        返回得分最高的 `k` 个结果 (单词序号, 匹配位置)，按得分从高到低排列，得分相同时较短、较靠前的单词在前
+        """
+        query = query.lower()
+        if len(query) == 0:
+            # 所有单词得分相同，按长度、顺序排列
+            count = len(self.words)
+            order = heapq.nsmallest(count if k is None else k, range(count), key=lambda i: (len(self.words[i]), i))
+            return [(i, []) for i in order]
+        heap: List[Tuple[int, int, int, List[int]]] = []
+        for i in self._candidates(query):
+            word = self.lower_words[i]
+            result = fuzzy_match(query, word)
+            if result is None:
+                continue
+            score, positions = result
+            item = (score, -len(word), -i, positions)
+            if k is None or len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item[:3] > heap[0][:3]:
+                heapq.heapreplace(heap, item)
+        heap.sort(key=lambda item: item[:3], reverse=True)
+        return [(-i, positions) for _, _, i, positions in heap]
@@ -0,0 +1,269 @@
+"""
+命令执行过程的耗时统计：分词、解析、错误检查和处理函数四个阶段的耗时按命令记录在直方图中，
+可以通过导出器保存每一次执行的记录，也可以用 cProfile 分析接下来的若干个命令。
+
+内置命令：
+    profile [N] [FILE]   用 cProfile 分析接下来的 N 个命令（默认 1 个），结束后输出统计信息或保存到 FILE
+    timings              输出每个命令各阶段的耗时
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, IO, List, Optional, Sequence
+
+from prompt_toolkit_ext.arg_parser import PromptArgumentParser
+
+
+PHASES = ('tokenize', 'parse', 'error_check', 'handler')
+BUILTIN_COMMANDS = ('profile', 'timings')
+# 直方图的桶数，第 i 个桶记录 [2^(i-1), 2^i) 微秒的耗时，最后一个桶记录更长的耗时
+BUCKETS = 40
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in power-of-two microsecond buckets.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        bucket = int(seconds * 1e6).bit_length()
+        self.counts[bucket if bucket < BUCKETS else BUCKETS - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        第 `p` (0-100) 百分位数的近似值（所在桶的上界，不超过最大值），单位为秒
+        """
+        if self.count == 0:
+            return 0.0
+        target = self.count * p / 100.0
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n > 0:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'buckets': {(1 << i): n for i, n in enumerate(self.counts) if n > 0},
+        }
+
+
+class CommandStats:
+    """
+    Per-phase histograms of one command.
+    """
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, LatencyHistogram] = {phase: LatencyHistogram() for phase in PHASES}
+        self.total = LatencyHistogram()
+        self.failed = 0
+
+
+class MemoryExporter:
+    """
+    Keeps the latest `maxlen` records in memory.
+    """
+
+    def __init__(self, maxlen: int = 10000) -> None:
+        self.records: Deque[dict] = deque(maxlen=maxlen)
+
+    def export(self, record: dict) -> None:
+        self.records.append(record)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesExporter:
+    """
+    Appends each record as one JSON line to a file.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+
+    def export(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.filename, 'a', encoding='utf-8', buffering=1)
+            self._file.write(line + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class PhaseTimer:
+    """
+    Timings of one command, created by :meth:`Instrumentation.start`.
+    """
+
+    __slots__ = ('started', 'last', 'phases')
+
+    def __init__(self) -> None:
+        self.started = self.last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        """
+        记录从上一次标记到现在的耗时
+        """
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+
+def command_name(parser: PromptArgumentParser) -> str:
+    """
+    最近一次解析经过的子命令，例如 "remote add"，没有子命令时返回根解析器的 prog
+    """
+    context = parser.get_parse_context()
+    if context is None or len(context.path) == 0:
+        return parser.prog
+    root_prog = context.path[0].prog
+    prog = context.path[-1].prog
+    if prog.startswith(root_prog):
+        prog = prog[len(root_prog):].strip()
+    return prog or root_prog
+
+
+class Instrumentation:
+    """
+    Collects per-command phase timings for :func:`run_line`.
+
+    Records are also passed to each exporter in `exporters`, see
+    :class:`MemoryExporter` and :class:`JsonLinesExporter`.
+    """
+
+    def __init__(self, exporters: Sequence = ()) -> None:
+        self.exporters = list(exporters)
+        self.stats: Dict[str, CommandStats] = {}
+        self._profile_remaining = 0
+        self._profile_file: Optional[str] = None
+        self._profiler: Optional[cProfile.Profile] = None
+
+    def profile_next(self, n: int = 1, filename: Optional[str] = None) -> None:
+        """
+        用 cProfile 分析接下来的 `n` 个命令，结束后输出统计信息，或者保存到 `filename`
+        """
+        self._profile_remaining = n
+        self._profile_file = filename
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+
+    def start(self) -> PhaseTimer:
+        if self._profile_remaining > 0:
+            self._profiler.enable()
+        return PhaseTimer()
+
+    def finish(self, timer: PhaseTimer, parser: PromptArgumentParser, ok: bool) -> None:
+        total = time.perf_counter() - timer.started
+        if self._profile_remaining > 0:
+            self._profiler.disable()
+            self._profile_remaining -= 1
+            if self._profile_remaining == 0:
+                self._dump_profile()
+
+        name = command_name(parser)
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CommandStats()
+        for phase, seconds in timer.phases.items():
+            stats.phases[phase].add(seconds)
+        stats.total.add(total)
+        if not ok:
+            stats.failed += 1
+
+        if self.exporters:
+            record = {
+                'time': time.time(),
+                'command': name,
+                'ok': ok,
+                'total': total,
+                'phases': timer.phases,
+            }
+            for exporter in self.exporters:
+                exporter.export(record)
+
+    def cancel(self, timer: PhaseTimer) -> None:
+        """
+        不记录这次执行（例如内置命令）
+        """
+        if self._profile_remaining > 0:
+            self._profiler.disable()
+
+    def _dump_profile(self) -> None:
+        profiler, self._profiler = self._profiler, None
+        if self._profile_file:
+            profiler.dump_stats(self._profile_file)
+            print('profile saved to %s' % self._profile_file)
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+        print(out.getvalue())
+
+    def report(self) -> str:
+        """
+        每个命令各阶段耗时的平均值和 p50/p99（毫秒）
+        """
+        lines: List[str] = ['%-24s %-12s %8s %10s %10s %10s' % ('command', 'phase', 'count', 'mean', 'p50', 'p99')]
+        for name in sorted(self.stats):
+            stats = self.stats[name]
+            for phase, hist in list(stats.phases.items()) + [('total', stats.total)]:
+                if hist.count == 0:
+                    continue
+                lines.append('%-24s %-12s %8d %10.3f %10.3f %10.3f' % (
+                    name, phase, hist.count, hist.mean * 1e3, hist.percentile(50) * 1e3, hist.percentile(99) * 1e3))
+        return '\n'.join(lines)
+
+    def is_builtin(self, args: List[str]) -> bool:
+        return len(args) > 0 and args[0] in BUILTIN_COMMANDS
+
+    def run_builtin(self, args: List[str]) -> None:
+        if args[0] == 'timings':
+            print(self.report())
+            return
+        try:
+            n = int(args[1]) if len(args) > 1 else 1
+        except ValueError:
+            print('usage: profile [N] [FILE]')
+            return
+        self.profile_next(n, args[2] if len(args) > 2 else None)
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close()
@@ -0,0 +1,174 @@
+"""
+后台任务：以 `&` 结尾的命令，或者默认值中 `background=True` 的命令，解析完成后交给线程池
+（或者传入的进程池）执行，不阻塞输入。
+
+内置命令：
+    jobs              列出任务
+    wait [ID ...]     等待指定任务或全部任务结束
+    cancel ID ...     取消还没有开始的任务
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import CancelledError, Executor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+BACKGROUND_SUFFIX = '&'
+BUILTIN_COMMANDS = ('jobs', 'wait', 'cancel')
+
+
+def split_background(line: str) -> Tuple[str, bool]:
+    """
+    去掉行尾单独的 `&`，返回 (命令, 是否在后台执行)
+    """
+    stripped = line.rstrip()
+    if stripped.endswith(BACKGROUND_SUFFIX) and (len(stripped) == 1 or stripped[-2] in ' \t'):
+        return stripped[:-1].rstrip(), True
+    return line, False
+
+
+class Job:
+    """
+    A command running in the background.
+    """
+
+    def __init__(self, job_id: int, line: str, future: Future) -> None:
+        self.id = job_id
+        self.line = line
+        self.future = future
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        future = self.future
+        if future.cancelled():
+            return 'cancelled'
+        if future.running():
+            return 'running'
+        if not future.done():
+            return 'pending'
+        if future.exception() is not None:
+            return 'failed'
+        return 'done'
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    def __str__(self) -> str:
+        text = '[%d] %-9s %7.1fs  %s' % (self.id, self.status, self.elapsed, self.line)
+        if self.status == 'failed':
+            text += '  (%s: %s)' % (type(self.future.exception()).__name__, self.future.exception())
+        return text
+
+
+class JobManager:
+    """
+    Runs command handlers in a bounded pool and keeps a table of jobs.
+
+    By default a :class:`ThreadPoolExecutor` with `max_workers` threads is
+    used; any other executor (e.g. a process pool, in which case handlers and
+    their arguments must be picklable) can be passed in.
+    """
+
+    def __init__(self, max_workers: int = 4, executor: Optional[Executor] = None,
+                 notify: bool = True, max_finished: int = 100) -> None:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.executor = executor
+        # 任务结束时输出一行提示
+        self.notify = notify
+        # 最多保留的已结束任务数
+        self.max_finished = max_finished
+        self._jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, line: str, func: Callable, *args) -> Job:
+        future = self.executor.submit(func, *args)
+        with self._lock:
+            job = Job(next(self._ids), line, future)
+            self._jobs[job.id] = job
+            self._prune()
+        print('[%d] %s' % (job.id, line))
+        future.add_done_callback(lambda f: self._on_done(job))
+        return job
+
+    def _on_done(self, job: Job) -> None:
+        job.finished = time.monotonic()
+        if self.notify:
+            # 在 patch_stdout 中输出时显示在提示符上方
+            print(job)
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def active(self) -> List[Job]:
+        return [job for job in self.jobs() if not job.future.done()]
+
+    def wait(self, job_ids: Optional[List[int]] = None, timeout: Optional[float] = None) -> List[Job]:
+        """
+        等待任务结束（默认等待全部任务），返回仍未结束的任务
+        """
+        if job_ids:
+            jobs = [job for job in (self.get(i) for i in job_ids) if job is not None]
+        else:
+            jobs = self.active()
+        _, not_done = wait_futures([job.future for job in jobs], timeout=timeout)
+        return [job for job in jobs if job.future in not_done]
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        取消还没有开始执行的任务，已经在执行的任务无法取消
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        return job.future.cancel()
+
+    split_background = staticmethod(split_background)
+
+    def is_builtin(self, args: List[str]) -> bool:
+        return len(args) > 0 and args[0] in BUILTIN_COMMANDS
+
+    def run_builtin(self, args: List[str]) -> None:
+        command = args[0]
+        try:
+            job_ids = [int(a) for a in args[1:] if a]
+        except ValueError:
+            print('%s: job id must be an integer' % command)
+            return
+
+        if command == 'jobs':
+            for job in self.jobs():
+                print(job)
+        elif command == 'wait':
+            try:
+                self.wait(job_ids)
+            except (KeyboardInterrupt, CancelledError):
+                pass
+        elif command == 'cancel':
+            if len(job_ids) == 0:
+                print('usage: cancel ID [ID ...]')
+            for job_id in job_ids:
+                if self.get(job_id) is None:
+                    print('cancel: no such job: %d' % job_id)
+                elif not self.cancel(job_id):
+                    print('cancel: job %d is already running or finished' % job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
@@ -5,13 +5,23 @@ from prompt_toolkit.completion import CompleteEvent
 from prompt_toolkit.completion import Completer, Completion
 from typing import Dict, Iterable, Optional
 
-from prompt_toolkit_ext import PromptCompleter
+from prompt_toolkit_ext.completer import PromptCompleter
 
 
 class PromptNestedCompleter(NestedCompleter):
 
+    def __init__(self, options: Dict[str, Optional[Completer]], ignore_case: bool = True) -> None:
+        super(PromptNestedCompleter, self).__init__(options, ignore_case)
+        self.help_info = None
+        # 每一层的键不变，创建一次补全器并复用其中的索引
+        self._key_completer = PromptCompleter(
+            list(self.options.keys()), ignore_case=self.ignore_case, match_middle=True
+        )
+        self._key_completer._get_word_index(self._key_completer.words)
+
     def set_help_info(self, help_info):
         self.help_info = help_info
+        self._key_completer.set_help_info(help_info)
 
     @classmethod
     def from_nested_dict(cls, data, help):
@@ -61,10 +71,6 @@ class PromptNestedCompleter(NestedCompleter):
 
         # No space in the input: behave exactly like `WordCompleter`.
         else:
-            completer = PromptCompleter(
-                list(self.options.keys()), ignore_case=self.ignore_case, match_middle=True
-            )
-            completer.set_help_info(self.help_info)
-            for c in completer.get_completions(document, complete_event):
+            for c in self._key_completer.get_completions(document, complete_event):
                 yield c
 
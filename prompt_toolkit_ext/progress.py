@@ -2,10 +2,12 @@ import functools
 import os
 import signal
 import threading
+import time
 import traceback
-from asyncio import get_event_loop, new_event_loop, set_event_loop
+from asyncio import Task, get_event_loop, get_running_loop, new_event_loop, set_event_loop
 from typing import (
     TYPE_CHECKING,
+    Dict,
     Generic,
     Iterable,
     List,
@@ -13,6 +15,7 @@ from typing import (
     Sequence,
     Sized,
     TextIO,
+    Tuple,
     TypeVar,
     cast,
 )
@@ -99,7 +102,11 @@ class Progress:
 
     :param title: Text to be displayed above the progress bars. This can be a
         callable or formatted text as well.
-    :param formatters: List of :class:`.Formatter` instances.
+    :param formatters: List of :class:`.Formatter` instances. Visible rows are
+        formatted again on every redraw. A formatter whose output depends only
+        on the model can set ``cacheable = True``; its rows are then formatted
+        again only after the model changes (:meth:`ProgressModel.invalidate`)
+        or the width changes. :class:`.Text` is cached by default.
     :param bottom_toolbar: Text to be displayed in the bottom toolbar. This
         can be a callable or formatted text.
     :param style: :class:`prompt_toolkit.styles.BaseStyle` instance.
@@ -109,6 +116,11 @@ class Progress:
     :param color_depth: `prompt_toolkit` `ColorDepth` instance.
     :param output: :class:`~prompt_toolkit.output.Output` instance.
     :param input: :class:`~prompt_toolkit.input.Input` instance.
+    :param refresh_interval: Redraw the UI every so many seconds, even when no
+        model was invalidated. `None` disables the periodic redraw.
+    :param invalidate_interval: Minimum time in seconds between two redraws
+        requested by :meth:`invalidate`. Requests made in between are merged
+        into one.
     """
 
     def __init__(
@@ -122,6 +134,8 @@ class Progress:
         color_depth: Optional[ColorDepth] = None,
         output: Optional[Output] = None,
         input: Optional[Input] = None,
+        refresh_interval: Optional[float] = 0.3,
+        invalidate_interval: float = 0.05,
     ) -> None:
 
         self.title = title
@@ -130,6 +144,11 @@ class Progress:
         self.models: List[ProgressModel] = []
         self.style = style
         self.key_bindings = key_bindings
+        self.refresh_interval = refresh_interval
+        self.invalidate_interval = invalidate_interval
+        # 已经安排了重绘，之后的请求不需要再通知界面线程
+        self._invalidate_pending = False
+        self._last_invalidate = 0.0
 
         # Note that we use __stderr__ as default error output, because that
         # works best with `patch_stdout`.
@@ -138,6 +157,8 @@ class Progress:
         self.input = input or get_app_session().input
 
         self._thread: Optional[threading.Thread] = None
+        # 通过 create_ui_async 在调用者的事件循环中运行
+        self._task: Optional[Task] = None
 
         self._loop = get_event_loop()
         self._app_loop = new_event_loop()
@@ -160,7 +181,8 @@ class Progress:
         def run() -> None:
             set_event_loop(self._app_loop)
             try:
-                self.app.run()
+                # app.run() 会创建新的事件循环，invalidate 需要界面运行在 self._app_loop 中
+                self._app_loop.run_until_complete(self.app.run_async())
             except BaseException as e:
                 traceback.print_exc()
                 print(e)
@@ -177,6 +199,24 @@ class Progress:
             self._previous_winch_handler = signal.getsignal(_SIGWINCH)
             self._loop.add_signal_handler(_SIGWINCH, self.invalidate)
 
+    def create_ui_async(self) -> Task:
+        """
+        在当前事件循环中运行界面，不创建新的线程，需要在协程中调用。
+        返回运行界面的任务，调用 :meth:`exit` 后可以等待它结束
+        """
+        self._create_app()
+
+        loop = get_running_loop()
+        if self._app_loop is not loop:
+            old_loop, self._app_loop = self._app_loop, loop
+            # 之前的 invalidate 把回调放在了旧的事件循环中，不会再执行
+            self._invalidate_pending = False
+            old_loop.close()
+
+        self._task = loop.create_task(self.app.run_async())
+        self.invalidate()
+        return self._task
+
     def _create_app(self):
         # Create UI Application.
         title_toolbar = ConditionalContainer(
@@ -235,7 +275,7 @@ class Progress:
             layout=Layout(self.root),
             style=self.style,
             key_bindings=self.key_bindings,
-            refresh_interval=0.3,
+            refresh_interval=self.refresh_interval,
             color_depth=self.color_depth,
             output=self.output,
             input=self.input,
@@ -270,7 +310,8 @@ class Progress:
         if self._thread is not None:
             self._thread.join()
 
-        if self._app_loop.is_running():
+        # 共用的事件循环由调用者管理
+        if self._task is None and self._app_loop.is_running():
             self._app_loop.close()
 
     def destroy(self):
@@ -287,7 +328,27 @@ class Progress:
         return model
 
     def invalidate(self) -> None:
-        self._app_loop.call_soon_threadsafe(self.app.invalidate)
+        """
+        请求重绘，可以在任何线程中调用。每个 `invalidate_interval` 最多唤醒界面线程一次
+        """
+        if self._invalidate_pending:
+            return
+        self._invalidate_pending = True
+        self._app_loop.call_soon_threadsafe(self._schedule_invalidate)
+
+    def _schedule_invalidate(self) -> None:
+        # 在界面线程中执行
+        delay = self._last_invalidate + self.invalidate_interval - time.monotonic()
+        if delay > 0:
+            self._app_loop.call_later(delay, self._do_invalidate)
+        else:
+            self._do_invalidate()
+
+    def _do_invalidate(self) -> None:
+        # 先清除标记：之后的修改会再次请求重绘，之前的修改在这次重绘中显示
+        self._invalidate_pending = False
+        self._last_invalidate = time.monotonic()
+        self.app.invalidate()
 
 
 class _ProgressControl(UIControl):
@@ -299,23 +360,43 @@ class _ProgressControl(UIControl):
         self.progress_bar = progress_bar
         self.formatter = formatter
         self._key_bindings = create_key_bindings()
+        # model -> (model.version, width, 格式化后的文本)
+        self._rows: Dict[ProgressModel, Tuple[int, int, StyleAndTextTuples]] = {}
+        # 默认每次重绘时都重新格式化（TimeElapsed 等 formatter 的结果与时间有关），
+        # 结果只与 model 有关的 formatter 可以设置 cacheable = True，model 没有修改时使用缓存
+        self._cacheable = getattr(formatter, 'cacheable', type(formatter) is Text)
+
+    def _format(self, model: "ProgressModel", width: int) -> StyleAndTextTuples:
+        # 先读取版本号，格式化期间的修改会在下一次重绘时生效
+        version = model.version
+        if self._cacheable:
+            cached = self._rows.get(model)
+            if cached is not None and cached[0] == version and cached[1] == width:
+                return cached[2]
+
+        try:
+            text = self.formatter.format(self.progress_bar, model, width)
+        except BaseException:
+            traceback.print_exc()
+            text = "ERROR"
+
+        fragments = to_formatted_text(text)
+        if self._cacheable:
+            self._rows[model] = (version, width, fragments)
+        return fragments
 
     def create_content(self, width: int, height: int) -> UIContent:
-        items: List[StyleAndTextTuples] = []
+        models = list(self.progress_bar.models)
 
-        for pr in self.progress_bar.models:
-            try:
-                text = self.formatter.format(self.progress_bar, pr, width)
-            except BaseException:
-                traceback.print_exc()
-                text = "ERROR"
-
-            items.append(to_formatted_text(text))
+        # 删除已经移除的 model 的缓存
+        if len(self._rows) > 2 * len(models) + 64:
+            self._rows = {m: self._rows[m] for m in models if m in self._rows}
 
+        # 只有显示出来的行才会调用 get_line，每次重绘的开销与屏幕高度有关，与 model 的数量无关
         def get_line(i: int) -> StyleAndTextTuples:
-            return items[i]
+            return self._format(models[i], width)
 
-        return UIContent(get_line=get_line, line_count=len(items), show_cursor=False)
+        return UIContent(get_line=get_line, line_count=len(models), show_cursor=False)
 
     def is_focusable(self) -> bool:
         return True  # Make sure that the key bindings work.
@@ -330,8 +411,11 @@ class ProgressModel:
         self.progress = progress
         self.remove_when_done = remove_when_done
         self._done = False
+        # 每次修改后加 1，界面只重新格式化版本号改变的行
+        self.version = 0
 
     def invalidate(self):
+        self.version += 1
         self.progress.invalidate()
 
     @property
@@ -341,6 +425,69 @@ class ProgressModel:
     @done.setter
     def done(self, value: bool) -> None:
         self._done = value
+        self.version += 1
 
         if value and self.remove_when_done:
             self.progress.models.remove(self)
+
+
+if __name__ == '__main__':
+    # 多个线程高频率更新时，合并重绘请求前后的回调次数、重绘次数和 CPU 时间
+    import asyncio
+    from prompt_toolkit.input import create_pipe_input
+    from prompt_toolkit.output import DummyOutput
+
+    def benchmark(coalesce: bool, threads: int = 4, duration: float = 1.0) -> None:
+        with create_pipe_input() as pipe_input:
+            progress = Progress(output=DummyOutput(), input=pipe_input)
+            models = [progress.create_model() for _ in range(1000)]
+            progress.create_ui()
+            while not progress.app.is_running:
+                time.sleep(0.01)
+
+            loop = progress._app_loop
+            callbacks = [0]
+            updates = [0] * threads
+            call_soon_threadsafe = loop.call_soon_threadsafe
+
+            def counting_call_soon_threadsafe(*args):
+                callbacks[0] += 1
+                return call_soon_threadsafe(*args)
+
+            loop.call_soon_threadsafe = counting_call_soon_threadsafe
+            renders = progress.app.render_counter
+
+            def worker(n: int, deadline: float) -> None:
+                i = 0
+                while time.perf_counter() < deadline:
+                    model = models[(n * 7919 + i) % len(models)]
+                    if coalesce:
+                        model.invalidate()
+                    else:
+                        # 原来的方式：每次更新都通知界面线程
+                        model.version += 1
+                        loop.call_soon_threadsafe(progress.app.invalidate)
+                    i += 1
+                updates[n] = i
+
+            cpu = time.process_time()
+            deadline = time.perf_counter() + duration
+            workers = [threading.Thread(target=worker, args=(n, deadline)) for n in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            # 等待界面线程处理完所有回调
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result()
+            cpu = time.process_time() - cpu
+
+            total = sum(updates)
+            print('%-10s %8d updates in %.1fs: %8d callbacks, %3d redraws, %.2fs cpu, %.2fus cpu per update' % (
+                'coalesced' if coalesce else 'direct', total, duration, callbacks[0],
+                progress.app.render_counter - renders, cpu, cpu / max(total, 1) * 1e6))
+
+            loop.call_soon_threadsafe = call_soon_threadsafe
+            progress.destroy()
+
+    benchmark(coalesce=False)
+    benchmark(coalesce=True)
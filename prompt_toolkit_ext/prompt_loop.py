@@ -0,0 +1,113 @@
+import asyncio
+import inspect
+from concurrent.futures import Executor
+from contextlib import nullcontext
+
+from prompt_toolkit.completion import Completer
+from prompt_toolkit.history import History
+from prompt_toolkit.lexers import Lexer
+from prompt_toolkit.patch_stdout import patch_stdout
+
+from prompt_toolkit_ext.arg_parser import PromptArgumentParser
+from prompt_toolkit_ext.instrument import Instrumentation
+from prompt_toolkit_ext.jobs import JobManager
+from prompt_toolkit_ext.runner import _line_tokenizer, run_line
+from prompt_toolkit_ext.search_index import IndexedPromptSession
+from prompt_toolkit_ext.tokenizer import Tokenizer
+
+
+def run_prompt(prompt_parser: PromptArgumentParser,
+               prompt_history: History = None,
+               prompt_completer: Completer = None,
+               prompt_lexer: Lexer = None,
+               job_manager: JobManager = None,
+               instrumentation: Instrumentation = None):
+    """
+    传入 `job_manager` 时支持后台任务，后台任务的输出显示在提示符上方；
+    传入 `instrumentation` 时记录每个命令的耗时
+    """
+
+    session = IndexedPromptSession(history=prompt_history,
+                                   completer=prompt_completer,
+                                   lexer=prompt_lexer)
+
+    with patch_stdout() if job_manager is not None else nullcontext():
+        while True:
+
+            user_input = session.prompt('# ')
+
+            if len(user_input.strip()) == 0:
+                continue
+
+            lines = user_input.split('\n')
+
+            for line in lines:
+                if line is None or len(line.strip()) == 0:
+                    continue
+                run_line(prompt_parser, line, job_manager=job_manager, instrumentation=instrumentation)
+
+
+async def run_prompt_async(prompt_parser: PromptArgumentParser,
+                           prompt_history: History = None,
+                           prompt_completer: Completer = None,
+                           prompt_lexer: Lexer = None,
+                           max_concurrency: int = 8,
+                           executor: Executor = None):
+    """
+    :func:`run_prompt` 的异步版本，与补全、:class:`.Progress`（通过 `create_ui_async`）共用
+    当前的事件循环。一次输入多行时最多同时执行 `max_concurrency` 个命令，全部结束后再显示提示符
+    """
+
+    session = IndexedPromptSession(history=prompt_history,
+                                   completer=prompt_completer,
+                                   lexer=prompt_lexer)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    while True:
+
+        user_input = await session.prompt_async('# ')
+
+        if len(user_input.strip()) == 0:
+            continue
+
+        lines = [line for line in user_input.split('\n') if len(line.strip()) > 0]
+
+        # 按顺序解析，命令的处理函数并发执行
+        results = await asyncio.gather(
+            *(run_line_async(prompt_parser, line, executor=executor, semaphore=semaphore) for line in lines),
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+
+async def run_line_async(parser: PromptArgumentParser, line: str, tokenizer: Tokenizer = None,
+                         executor: Executor = None, semaphore: asyncio.Semaphore = None) -> bool:
+    """
+    执行一行命令，成功时返回 True。`func` 为协程函数时直接等待，否则在 `executor` 中执行
+    """
+    if tokenizer is None:
+        tokenizer = _line_tokenizer
+    arg_array = tokenizer.split(line)
+    try:
+        parser.clear_error_flag()
+        args = parser.parse_args(arg_array)
+        if parser.has_error_flag():
+            return False
+    except TypeError as e:
+        print(e)
+        return False
+
+    func = getattr(args, 'func', None)
+    if func is None:
+        return True
+    async with semaphore if semaphore is not None else nullcontext():
+        try:
+            if inspect.iscoroutinefunction(func):
+                await func(args)
+            else:
+                await asyncio.get_running_loop().run_in_executor(executor, func, args)
+        except TypeError as e:
+            print(e)
+            return False
+    return True
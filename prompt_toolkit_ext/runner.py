@@ -0,0 +1,68 @@
+"""
+执行一行命令。这里只依赖解析器和分词器，只需要 run_line 的脚本不会导入 prompt_toolkit
+"""
+
+from typing import TYPE_CHECKING
+
+from prompt_toolkit_ext.arg_parser import PromptArgumentParser
+from prompt_toolkit_ext.tokenizer import Tokenizer
+
+if TYPE_CHECKING:
+    from prompt_toolkit_ext.instrument import Instrumentation
+    from prompt_toolkit_ext.jobs import JobManager
+
+
+_line_tokenizer = Tokenizer()
+
+
+def run_line(parser: PromptArgumentParser, line: str, tokenizer: Tokenizer = None,
+             job_manager: 'JobManager' = None, instrumentation: 'Instrumentation' = None) -> bool:
+    """
+    执行一行命令，成功时返回 True。
+
+    传入 `job_manager` 时，以 `&` 结尾或默认值中 `background=True` 的命令在后台执行，
+    并且可以使用 jobs、wait、cancel 命令；传入 `instrumentation` 时记录各阶段的耗时，
+    并且可以使用 profile、timings 命令（解析器中有同名命令时优先使用解析器的命令）
+    """
+    if tokenizer is None:
+        tokenizer = _line_tokenizer
+    background = False
+    if job_manager is not None:
+        line, background = job_manager.split_background(line)
+    timer = instrumentation.start() if instrumentation is not None else None
+    arg_array = tokenizer.split(line)
+    if timer is not None:
+        timer.mark('tokenize')
+
+    for builtins in (job_manager, instrumentation):
+        if builtins is not None and builtins.is_builtin(arg_array) \
+                and parser.get_subparser_by_command(arg_array[0]) is None:
+            if timer is not None:
+                instrumentation.cancel(timer)
+            builtins.run_builtin(arg_array)
+            return True
+
+    ok = False
+    try:
+        parser.clear_error_flag()
+        args = parser.parse_args(arg_array)
+        if timer is not None:
+            timer.mark('parse')
+        has_error = parser.has_error_flag()
+        if timer is not None:
+            timer.mark('error_check')
+        if not has_error:
+            if hasattr(args, 'func'):
+                if job_manager is not None and (background or getattr(args, 'background', False)):
+                    job_manager.submit(line, args.func, args)
+                else:
+                    args.func(args)
+                if timer is not None:
+                    timer.mark('handler')
+            ok = True
+    except TypeError as e:
+        print(e)
+    finally:
+        if timer is not None:
+            instrumentation.finish(timer, parser, ok)
+    return ok
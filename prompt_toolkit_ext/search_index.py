@@ -0,0 +1,185 @@
+import itertools
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.document import Document
+from prompt_toolkit.search import SearchDirection, SearchState
+from prompt_toolkit.shortcuts import PromptSession
+
+
+class NgramIndex:
+    """
+    n-gram 倒排索引，文本按添加顺序编号（从 0 开始），每个 n-gram 对应一个递增的编号列表。
+
+    索引中保存长度为 `min_n` 到 `n` 的所有 n-gram（均转为小写），长度不小于 `min_n` 的
+    查询只需要检查最短的倒排列表中的文本。
+    """
+
+    def __init__(self, n: int = 3, min_n: Optional[int] = None) -> None:
+        self.n = n
+        self.min_n = n if min_n is None else min_n
+        self.postings: Dict[str, List[int]] = {}
+        self.count = 0
+
+    def _grams(self, text: str, size: int):
+        return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+    def add(self, text: str) -> int:
+        i = self.count
+        self.count += 1
+        text = text.lower()
+        for size in range(self.min_n, self.n + 1):
+            for gram in self._grams(text, size):
+                self.postings.setdefault(gram, []).append(i)
+        return i
+
+    def candidates(self, query: str) -> Optional[List[int]]:
+        """
+        返回可能包含 `query` 的文本编号（升序），`query` 过短无法使用索引时返回 None
+        """
+        if len(query) < self.min_n:
+            return None
+        query = query.lower()
+        best: Optional[List[int]] = None
+        for gram in self._grams(query, min(self.n, len(query))):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            if best is None or len(posting) < len(best):
+                best = posting
+        return best
+
+
+class WordIndex:
+    """
+    固定单词列表的索引：排序后的单词用于二分查找前缀，n-gram 索引用于查找包含子串的单词。
+    查询结果为单词在原列表中的下标，按原来的顺序排列。
+    """
+
+    def __init__(self, words: List[str], ignore_case: bool = False) -> None:
+        self.words = words
+        self.ignore_case = ignore_case
+        self._keys = [w.lower() for w in words] if ignore_case else list(words)
+        self._sorted_pos = sorted(range(len(words)), key=self._keys.__getitem__)
+        self._sorted_keys = [self._keys[i] for i in self._sorted_pos]
+        self._ngrams = NgramIndex(n=3, min_n=1)
+        for w in words:
+            self._ngrams.add(w)
+
+    def match(self, text: str, match_middle: bool = False) -> List[int]:
+        if self.ignore_case:
+            text = text.lower()
+        if len(text) == 0:
+            return list(range(len(self.words)))
+
+        if match_middle:
+            return [i for i in self._ngrams.candidates(text) if text in self._keys[i]]
+
+        start = bisect_left(self._sorted_keys, text)
+        end = start
+        while end < len(self._sorted_keys) and self._sorted_keys[end].startswith(text):
+            end += 1
+        return sorted(self._sorted_pos[start:end])
+
+
+class HistorySearchIndex:
+    """
+    历史记录的子串搜索索引，按历史记录的顺序编号（0 为最早的记录），与
+    :meth:`History.get_strings` 的下标一致。
+    """
+
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self._lower_strings: List[str] = []
+        self._index = NgramIndex()
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def add(self, string: str) -> None:
+        self.strings.append(string)
+        self._lower_strings.append(string.lower())
+        self._index.add(string)
+
+    def search(self, text: str, ignore_case: bool = False,
+               before: Optional[int] = None) -> Iterator[int]:
+        """
+        按从新到旧的顺序返回包含 `text` 的历史记录编号，只返回小于 `before` 的编号
+        """
+        if before is None or before > len(self.strings):
+            before = len(self.strings)
+        strings = self._lower_strings if ignore_case else self.strings
+        if ignore_case:
+            text = text.lower()
+
+        candidates = self._index.candidates(text)
+        if candidates is None:
+            ids = range(before - 1, -1, -1)
+        else:
+            ids = (candidates[i] for i in range(bisect_left(candidates, before) - 1, -1, -1))
+
+        for i in ids:
+            if text in strings[i]:
+                yield i
+
+
+class IndexedSearchBuffer(Buffer):
+    """
+    :class:`.Buffer` that uses the `search_index` of its history (when there
+    is one) for backward searches through the history, instead of scanning
+    every history entry.
+    """
+
+    def _search(
+        self,
+        search_state: SearchState,
+        include_current_position: bool = False,
+        count: int = 1,
+    ) -> Optional[Tuple[int, int]]:
+        search_index: Optional[HistorySearchIndex] = getattr(self.history, 'search_index', None)
+        if search_index is None or search_state.direction != SearchDirection.BACKWARD or not search_state.text:
+            return super(IndexedSearchBuffer, self)._search(search_state, include_current_position, count)
+
+        text = search_state.text
+        ignore_case = search_state.ignore_case()
+        # 历史记录可能还在加载，工作行只包含最新的一部分历史记录（最后一行为当前输入）
+        offset = len(search_index) - (len(self._working_lines) - 1)
+
+        working_index = self.working_index
+        document = self.document
+        for _ in range(count):
+            new_index = document.find_backwards(text, ignore_case=ignore_case)
+            if new_index is not None:
+                document = Document(document.text, document.cursor_position + new_index)
+                continue
+
+            result = None
+            # 工作行可能已被编辑过，需要在工作行中再次确认
+            candidates = (i - offset for i in search_index.search(text, ignore_case, before=working_index + offset))
+            candidates = itertools.takewhile(lambda i: i >= 0, candidates)
+            # 与 Buffer._search 一致，最后回到当前输入行查找
+            for i in itertools.chain(candidates, [len(self._working_lines) - 1]):
+                line = self._working_lines[i]
+                new_index = Document(line, len(line)).find_backwards(text, ignore_case=ignore_case)
+                if new_index is not None:
+                    result = i, Document(line, len(line) + new_index)
+                    break
+            if result is None:
+                return None
+            working_index, document = result
+
+        return working_index, document.cursor_position
+
+
+class IndexedPromptSession(PromptSession):
+    """
+    :class:`.PromptSession` whose default buffer is an
+    :class:`IndexedSearchBuffer`.
+    """
+
+    def _create_default_buffer(self) -> Buffer:
+        buffer = super(IndexedPromptSession, self)._create_default_buffer()
+        # 复用 PromptSession 创建缓冲区时的全部参数，只替换搜索的实现
+        buffer.__class__ = IndexedSearchBuffer
+        return buffer
@@ -0,0 +1,214 @@
+"""
+根据解析器高亮命令行：子命令、参数和参数值按解析器的定义分别显示，不存在的子命令或参数、
+属于其他子命令的参数也分别显示
+"""
+
+import argparse
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prompt_toolkit.document import Document
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+from prompt_toolkit.lexers import Lexer
+from prompt_toolkit.styles import Style
+
+from prompt_toolkit_ext.arg_parser import (LazyParser, ParserIndex, PromptArgumentParser, nargs_range,
+                                          parser_generation, resolve_parser)
+from prompt_toolkit_ext.tokenizer import tokenize
+from prompt_toolkit_ext.utils import LRUCache
+
+
+COMMAND = 'class:argparse.command'
+OPTION = 'class:argparse.option'
+VALUE = 'class:argparse.value'
+ARGUMENT = 'class:argparse.argument'
+UNKNOWN = 'class:argparse.unknown'
+MISPLACED = 'class:argparse.misplaced'
+
+DEFAULT_STYLE = Style.from_dict({
+    'argparse.command': 'fg:ansiblue bold',
+    'argparse.option': 'fg:ansicyan',
+    'argparse.value': 'fg:ansigreen',
+    'argparse.unknown': 'fg:ansired underline',
+    'argparse.misplaced': 'fg:ansiyellow underline',
+})
+
+
+class ParserTreeIndex:
+    """
+    Indexes of all built parsers in a parser tree, plus a map from each option
+    string to the parsers that define it.
+
+    Lazy subcommands that are not built yet are not walked. The tree index is
+    no longer valid once any parser gets a new argument or subcommand, or a
+    lazy subcommand is built, see :func:`parser_generation`.
+    """
+
+    def __init__(self, root: argparse.ArgumentParser) -> None:
+        self.root = root
+        self.generation = parser_generation()
+        self._indexes: Dict[int, Tuple[argparse.ArgumentParser, ParserIndex]] = {}
+        # 不是 PromptArgumentParser 的解析器不会更新版本号，需要单独检查
+        self._plain_indexes: List[ParserIndex] = []
+        # 参数 -> 定义它的解析器
+        self.option_owners: Dict[str, List[argparse.ArgumentParser]] = {}
+
+        stack = [root]
+        while stack:
+            parser = stack.pop()
+            if id(parser) in self._indexes:
+                continue
+            if isinstance(parser, PromptArgumentParser):
+                index = parser.get_index()
+            else:
+                index = ParserIndex(parser)
+                self._plain_indexes.append(index)
+            self._indexes[id(parser)] = (parser, index)
+            for opt_str in index.options:
+                self.option_owners.setdefault(opt_str, []).append(parser)
+            for entry in index.commands.values():
+                if not isinstance(entry, LazyParser) or entry.materialized:
+                    stack.append(resolve_parser(entry))
+
+    def is_valid(self) -> bool:
+        if self.generation != parser_generation():
+            return False
+        return all(index.is_valid() for index in self._plain_indexes)
+
+    def get_index(self, parser: argparse.ArgumentParser) -> ParserIndex:
+        item = self._indexes.get(id(parser))
+        if item is not None:
+            return item[1]
+        # 刚刚创建的延迟加载的解析器，下一次重新建立索引时才会加入
+        return parser.get_index() if isinstance(parser, PromptArgumentParser) else ParserIndex(parser)
+
+
+class _LineState:
+    """
+    Where the lexer is in the parser tree while walking one line.
+    """
+
+    def __init__(self, tree: ParserTreeIndex, parser: argparse.ArgumentParser) -> None:
+        self.tree = tree
+        self.enter(parser)
+        # 还可以输入的参数值个数，None 表示没有上限
+        self.values: Optional[int] = 0
+        # 遇到 "--" 之后都是位置参数
+        self.only_positionals = False
+
+    def enter(self, parser: argparse.ArgumentParser) -> None:
+        self.parser = parser
+        self.index = self.tree.get_index(parser)
+        # 还可以输入的位置参数个数
+        self.positionals: Optional[int] = self.index.positional_capacity
+
+
+class ArgParseSemanticLexer(Lexer):
+    """
+    Highlights a command line by resolving its words against the parser tree.
+
+    Subcommands, options, option values and positional arguments get the
+    ``argparse.*`` style classes, see :data:`DEFAULT_STYLE`; unknown words and
+    options that belong to another subcommand get ``argparse.unknown`` and
+    ``argparse.misplaced``. Lines are cached by content in an LRU cache of
+    `cache_size` lines until the parser tree changes.
+    """
+
+    def __init__(self, parser: PromptArgumentParser, cache_size: int = 2048) -> None:
+        self.parser = parser
+        self._tree: Optional[ParserTreeIndex] = None
+        # 每次重新建立索引时加 1，旧的缓存不再使用
+        self._generation = 0
+        self._line_cache = LRUCache(cache_size)
+
+    def get_tree_index(self) -> ParserTreeIndex:
+        tree = self._tree
+        if tree is None or not tree.is_valid():
+            tree = self._tree = ParserTreeIndex(self.parser)
+            self._generation += 1
+        return tree
+
+    def lex_document(self, document: Document) -> Callable[[int], StyleAndTextTuples]:
+        tree = self.get_tree_index()
+        generation = self._generation
+        lines = document.lines
+
+        def get_line(lineno: int) -> StyleAndTextTuples:
+            try:
+                line = lines[lineno]
+            except IndexError:
+                return []
+            key = (generation, line)
+            fragments = self._line_cache.get(key)
+            if fragments is None:
+                fragments = self._line_cache[key] = self.lex_line(tree, line)
+            return fragments
+
+        return get_line
+
+    def lex_line(self, tree: ParserTreeIndex, line: str) -> StyleAndTextTuples:
+        fragments: StyleAndTextTuples = []
+        state = _LineState(tree, tree.root)
+        pos = 0
+        for token in tokenize(line):
+            if token.start > pos:
+                fragments.append(('', line[pos:token.start]))
+            text = line[token.start:token.end]
+            if text:
+                fragments.append((self._classify(state, token.value, text[0] == '"'), text))
+            pos = token.end
+        if pos < len(line):
+            fragments.append(('', line[pos:]))
+        return fragments
+
+    @staticmethod
+    def _is_option(parser: argparse.ArgumentParser, value: str) -> bool:
+        if len(value) < 2 or value[0] not in parser.prefix_chars:
+            return False
+        # 与 argparse 相同：解析器没有像负数的参数时，负数是参数值
+        matcher = getattr(parser, '_negative_number_matcher', None)
+        if matcher is not None and matcher.match(value) and not parser._has_negative_number_optionals:
+            return False
+        return True
+
+    def _classify(self, state: _LineState, value: str, quoted: bool) -> str:
+        if not quoted and not state.only_positionals and self._is_option(state.parser, value):
+            if value == '--':
+                state.only_positionals = True
+                state.values = 0
+                return OPTION
+            return self._classify_option(state, value)
+
+        if state.values is None or state.values > 0:
+            if state.values is not None:
+                state.values -= 1
+            return VALUE
+
+        index = state.index
+        if index.commands and not state.only_positionals:
+            entry = index.commands.get(value)
+            if entry is not None:
+                state.enter(resolve_parser(entry))
+                return COMMAND
+        # 没有（更多）位置参数时多余的单词无法解析
+        if state.positionals == 0:
+            return UNKNOWN
+        if state.positionals:
+            state.positionals -= 1
+        return ARGUMENT
+
+    def _classify_option(self, state: _LineState, value: str) -> str:
+        opt_str, eq, _ = value.partition('=')
+        index = state.index
+        action = index.options.get(opt_str)
+        if action is None and getattr(state.parser, 'allow_abbrev', True):
+            # 唯一的前缀也可以使用
+            actions = {index.options[o] for o in index.match_options(opt_str)}
+            if len(actions) == 1:
+                action = actions.pop()
+        if action is None:
+            state.values = 0
+            if opt_str in state.tree.option_owners:
+                return MISPLACED
+            return UNKNOWN
+        state.values = 0 if eq else nargs_range(action.nargs)[1]
+        return OPTION
@@ -0,0 +1,131 @@
+"""
+命令行分词，结果与 csv.reader(StringIO(line), delimiter=' ') 读取的第一行相同：
+以单个空格分隔参数（连续的空格产生空参数），参数开头的双引号开始引号内的内容，引号内两个
+连续的双引号表示一个双引号，换行符结束当前行。
+"""
+
+from typing import List, NamedTuple, Optional, Tuple
+
+
+DELIMITER = ' '
+QUOTE = '"'
+LINE_END = '\r\n'
+
+_START_FIELD = 0
+_IN_FIELD = 1
+_IN_QUOTED_FIELD = 2
+_QUOTE_IN_QUOTED_FIELD = 3
+
+
+class Token(NamedTuple):
+    # 去掉引号后的参数值
+    value: str
+    # 参数在原始文本中的位置（包含引号），end 不包含在内
+    start: int
+    end: int
+
+
+def _scan(text: str, tokens: List[Token], pos: int) -> bool:
+    """
+    从 `pos`（一个参数的开头）开始分词，结果追加到 `tokens`，遇到换行符时返回 True
+    """
+    state = _START_FIELD
+    start = pos
+    chars: List[str] = []
+    length = len(text)
+
+    while pos < length:
+        c = text[pos]
+        if state == _START_FIELD:
+            if c in LINE_END:
+                tokens.append(Token('', start, pos))
+                return True
+            elif c == QUOTE:
+                state = _IN_QUOTED_FIELD
+            elif c == DELIMITER:
+                tokens.append(Token('', start, pos))
+                start = pos + 1
+            else:
+                chars.append(c)
+                state = _IN_FIELD
+        elif state == _IN_FIELD:
+            if c in LINE_END:
+                tokens.append(Token(''.join(chars), start, pos))
+                return True
+            elif c == DELIMITER:
+                tokens.append(Token(''.join(chars), start, pos))
+                chars = []
+                start = pos + 1
+                state = _START_FIELD
+            else:
+                chars.append(c)
+        elif state == _IN_QUOTED_FIELD:
+            if c == QUOTE:
+                state = _QUOTE_IN_QUOTED_FIELD
+            else:
+                chars.append(c)
+        else:
+            if c == QUOTE:
+                chars.append(c)
+                state = _IN_QUOTED_FIELD
+            elif c == DELIMITER:
+                tokens.append(Token(''.join(chars), start, pos))
+                chars = []
+                start = pos + 1
+                state = _START_FIELD
+            elif c in LINE_END:
+                tokens.append(Token(''.join(chars), start, pos))
+                return True
+            else:
+                chars.append(c)
+                state = _IN_FIELD
+        pos += 1
+
+    tokens.append(Token(''.join(chars), start, pos))
+    return False
+
+
+def tokenize(text: str) -> List[Token]:
+    tokens: List[Token] = []
+    if len(text) > 0 and text[0] not in LINE_END:
+        _scan(text, tokens, 0)
+    return tokens
+
+
+def split_line(text: str) -> List[str]:
+    return [t.value for t in tokenize(text)]
+
+
+class Tokenizer:
+    """
+    带缓存的分词器。新的文本以上一次的文本开头时（例如在行尾继续输入），只重新分析最后一个参数。
+    """
+
+    def __init__(self) -> None:
+        # (text, tokens, 是否已遇到换行符)
+        self._cache: Optional[Tuple[str, List[Token], bool]] = None
+
+    def tokenize(self, text: str) -> List[Token]:
+        cache = self._cache
+        if cache is not None:
+            cached_text, cached_tokens, line_end = cache
+            if text == cached_text:
+                return list(cached_tokens)
+            if len(cached_tokens) > 0 and text.startswith(cached_text):
+                if line_end:
+                    tokens = cached_tokens
+                else:
+                    tokens = cached_tokens[:-1]
+                    line_end = _scan(text, tokens, cached_tokens[-1].start)
+                self._cache = (text, tokens, line_end)
+                return list(tokens)
+
+        tokens = []
+        line_end = False
+        if len(text) > 0 and text[0] not in LINE_END:
+            line_end = _scan(text, tokens, 0)
+        self._cache = (text, tokens, line_end)
+        return list(tokens)
+
+    def split(self, text: str) -> List[str]:
+        return [t.value for t in self.tokenize(text)]
@@ -1,5 +1,14 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+
 from prompt_toolkit.utils import get_cwidth
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 
 def fill_right(string, max_len, c=' '):
     str_len = get_cwidth(string)
@@ -7,3 +16,94 @@ def fill_right(string, max_len, c=' '):
     if fill_count <= 0:
         return string
     return string + c * fill_count
+
+
+@contextmanager
+def file_lock(filename):
+    """
+    对 `filename` 加独占的建议锁（advisory lock），退出时释放，文件不存在时会被创建
+    """
+    with open(filename, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class LRUCache:
+    """
+    最多保存 `maxsize` 项的缓存，超出时删除最久未使用的项
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+
+class DisplayCache:
+    """
+    补全菜单显示内容的缓存，保存已经生成的格式化文本和文本的显示宽度
+    """
+
+    def __init__(self, maxsize=4096):
+        self._displays = LRUCache(maxsize)
+        self._widths = LRUCache(maxsize)
+
+    def width(self, text):
+        width = self._widths.get(text)
+        if width is None:
+            width = get_cwidth(text)
+            self._widths[text] = width
+        return width
+
+    def fill_right(self, text, max_len, c=' '):
+        fill_count = max_len - self.width(text)
+        if fill_count <= 0:
+            return text
+        return text + c * fill_count
+
+    def get(self, key, create):
+        display = self._displays.get(key)
+        if display is None:
+            display = create()
+            self._displays[key] = display
+        return display
+
+    def clear(self):
+        self._displays.clear()
+        self._widths.clear()
@@ -0,0 +1,146 @@
+"""
+输入时在后台线程中用解析器检查命令行，错误信息显示在工具栏中
+"""
+
+import asyncio
+import re
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from prompt_toolkit.application.current import get_app_or_none
+from prompt_toolkit.document import Document
+from prompt_toolkit.validation import ValidationError, Validator
+
+from prompt_toolkit_ext.arg_parser import PromptArgumentParser, parser_generation
+from prompt_toolkit_ext.tokenizer import Token, tokenize
+from prompt_toolkit_ext.utils import LRUCache
+
+
+# argparse 错误信息中出错的值或参数
+_INVALID_VALUE = re.compile(r"invalid (?:choice|[\w.]+ value): '((?:[^'\\]|\\.)*)'")
+_UNRECOGNIZED = re.compile(r"unrecognized arguments: (\S+)")
+_ARGUMENT = re.compile(r"^argument ([^:]+):")
+
+
+def _strip_prog(message: str) -> str:
+    """
+    去掉 "prog: error: " 前缀
+    """
+    message = message.strip()
+    _, sep, rest = message.partition(': error: ')
+    return rest if sep else message
+
+
+def locate_error(message: str, tokens: List[Token], text: str) -> int:
+    """
+    根据错误信息找到出错的参数在 `text` 中的位置，找不到时返回行尾
+    """
+    m = _INVALID_VALUE.search(message) or _UNRECOGNIZED.search(message)
+    if m is not None:
+        value = m.group(1)
+        for token in tokens:
+            if token.value == value:
+                return token.start
+    m = _ARGUMENT.search(message)
+    if m is not None:
+        names = m.group(1).split('/')
+        for token in tokens:
+            if token.value.partition('=')[0] in names:
+                return token.start
+    return len(text)
+
+
+class ArgParserValidator(Validator):
+    """
+    Validates the input by parsing it with the parser, without running the
+    command. Parse errors are reported with the argparse message and the
+    position of the offending argument.
+
+    The parse is a dry run (see :meth:`PromptArgumentParser.parse_args`):
+    `type` callables other than the built-in ones such as :class:`int` and
+    custom actions are not run, so their errors only show up when the
+    command is executed.
+
+    :meth:`validate_async`, which prompt_toolkit uses while typing, waits
+    `delay` seconds and skips the parse if the text changed in the meantime.
+    The parse itself runs in a worker thread. Results are cached per line in
+    an LRU cache of `cache_size` entries.
+    """
+
+    def __init__(self, parser: PromptArgumentParser, delay: float = 0.2, cache_size: int = 256,
+                 executor: Optional[Executor] = None) -> None:
+        self.parser = parser
+        self.delay = delay
+        self._cache = LRUCache(cache_size)
+        self._executor = executor
+        # 最近一次请求检查的文本
+        self._latest: Optional[str] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            # 只使用一个线程，过期的检查不会堆积
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='validator')
+        return self._executor
+
+    def _cache_key(self, text: str) -> Tuple[int, str]:
+        # 解析器添加参数或子命令后版本号改变，旧的结果不再使用
+        return parser_generation(), text
+
+    def check(self, text: str) -> Optional[Tuple[str, int]]:
+        """
+        解析 `text`，出错时返回 (错误信息, 位置)。可以在任何线程中调用
+        """
+        key = self._cache_key(text)
+        result = self._cache.get(key, False)
+        if result is not False:
+            return result
+
+        tokens = tokenize(text)
+        message = None
+        try:
+            self.parser.parse_args([t.value for t in tokens], silent=True, dry_run=True)
+            context = self.parser.get_parse_context()
+            # -h 等正常退出时没有错误信息
+            if context is not None and context.has_error and context.error:
+                message = _strip_prog(context.error)
+        except Exception as e:
+            message = '%s: %s' % (type(e).__name__, e)
+
+        result = None
+        if message is not None:
+            result = (message, locate_error(message, tokens, text))
+        self._cache[key] = result
+        return result
+
+    def _is_stale(self, text: str) -> bool:
+        if text != self._latest:
+            return True
+        # 在 prompt_toolkit 中，检查期间的输入会在这次检查结束后重新检查
+        app = get_app_or_none()
+        if app is not None and app.current_buffer.validator is self:
+            return app.current_buffer.text != text
+        return False
+
+    def validate(self, document: Document) -> None:
+        result = self.check(document.text)
+        if result is not None:
+            message, position = result
+            raise ValidationError(cursor_position=position, message=message)
+
+    async def validate_async(self, document: Document) -> None:
+        text = document.text
+        self._latest = text
+        key = self._cache_key(text)
+        result = self._cache.get(key, False)
+        if result is False:
+            if self.delay > 0:
+                await asyncio.sleep(self.delay)
+                if self._is_stale(text):
+                    return
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), self.check, text)
+            if self._is_stale(text):
+                return
+        if result is not None:
+            message, position = result
+            raise ValidationError(cursor_position=position, message=message)
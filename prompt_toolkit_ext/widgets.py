@@ -1,6 +1,4 @@
 from typing import Sequence, Tuple, List
-import qrcode
-from axel import Event
 
 from prompt_toolkit.widgets import RadioList as _RadioList
 from prompt_toolkit.widgets.base import _T
@@ -16,6 +14,8 @@ class RadioList(_RadioList):
 
     def __init__(self, values: Sequence[Tuple[_T, AnyFormattedText]]) -> None:
         super().__init__(values)
+        # axel 只在使用时导入
+        from axel import Event
         self.handlers = []
         self.check_event = Event()
 
@@ -103,6 +103,8 @@ class BarCode(UIControl):
         white_block = '▇'
         black_block = '  '
 
+        import qrcode
+
         qr = qrcode.QRCode(version)
         qr.add_data(self.text)
         qr.make()
@@ -0,0 +1,112 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from prompt_toolkit_ext.utils import LRUCache
+
+
+WordsFunc = Callable[..., Union[List[str], Awaitable[List[str]]]]
+
+
+class CachedWordsProvider:
+    """
+    Cached source of words for :class:`.PromptCompleter`.
+
+    `func` can be a normal function, which is run in an executor, or a
+    coroutine function. With `by_prefix` it is called with the word before
+    the cursor and the results are cached per prefix, otherwise it is called
+    without arguments. Results are kept for `ttl` seconds in an LRU cache of
+    `maxsize` entries. Concurrent lookups of the same key share one call and
+    starting a lookup for a new prefix cancels the lookups of older ones.
+    """
+
+    def __init__(self, func: WordsFunc, ttl: float = 30.0, maxsize: int = 64,
+                 by_prefix: bool = False) -> None:
+        self.func = func
+        self.ttl = ttl
+        self.by_prefix = by_prefix
+        self._cache = LRUCache(maxsize)
+        self._pending: Dict[str, asyncio.Task] = {}
+        # 最近一次得到的结果，新前缀没有缓存时先使用它
+        self._last_words: Optional[List[str]] = None
+
+    def _key(self, prefix: str) -> str:
+        return prefix if self.by_prefix else ''
+
+    def _args(self, key: str) -> Tuple[Any, ...]:
+        return (key,) if self.by_prefix else ()
+
+    def get_cached(self, prefix: str) -> Tuple[Optional[List[str]], bool]:
+        """
+        返回 (缓存的单词, 是否未过期)，没有缓存时返回最近一次的结果
+        """
+        entry = self._cache.get(self._key(prefix))
+        if entry is None:
+            return self._last_words, False
+        timestamp, words = entry
+        return words, time.monotonic() - timestamp < self.ttl
+
+    def _store(self, key: str, words: List[str]) -> List[str]:
+        words = list(words)
+        self._cache[key] = (time.monotonic(), words)
+        self._last_words = words
+        return words
+
+    async def fetch(self, prefix: str) -> List[str]:
+        """
+        获取最新的单词并更新缓存
+        """
+        key = self._key(prefix)
+        task = self._pending.get(key)
+        if task is None:
+            # 新的前缀，之前的查询已经没有用了
+            for stale_key, stale_task in list(self._pending.items()):
+                stale_task.cancel()
+                del self._pending[stale_key]
+            task = asyncio.ensure_future(self._call(key))
+            self._pending[key] = task
+
+            def done(t: asyncio.Task) -> None:
+                if self._pending.get(key) is t:
+                    del self._pending[key]
+
+            task.add_done_callback(done)
+        # 等待的一方被取消时不影响其他等待同一结果的调用
+        return await asyncio.shield(task)
+
+    async def _call(self, key: str) -> List[str]:
+        if inspect.iscoroutinefunction(self.func):
+            words = await self.func(*self._args(key))
+        else:
+            loop = asyncio.get_running_loop()
+            words = await loop.run_in_executor(None, lambda: self.func(*self._args(key)))
+        return self._store(key, words)
+
+    def refresh(self, prefix: str) -> None:
+        """
+        在后台更新缓存，需要在事件循环中调用
+        """
+        task = asyncio.ensure_future(self.fetch(prefix))
+        # 后台更新失败时保留原来的缓存
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def get_words(self, prefix: str) -> List[str]:
+        """
+        同步获取单词：缓存未过期时直接返回；在事件循环中时先返回旧的结果并在后台更新；
+        否则同步调用 `func`
+        """
+        words, fresh = self.get_cached(prefix)
+        if fresh:
+            return words
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            key = self._key(prefix)
+            if inspect.iscoroutinefunction(self.func):
+                return asyncio.run(self._call(key))
+            return self._store(key, self.func(*self._args(key)))
+
+        self.refresh(prefix)
+        return words or []
@@ -0,0 +1,48 @@
+"""
+导入时间的回归测试：导入 prompt_toolkit_ext 时不能导入较重的依赖，导入时间与导入 prompt_toolkit
+相比要小得多（只比较同一台机器上的相对时间，不使用固定的预算）
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('prompt_toolkit', 'pygments', 'qrcode', 'axel')
+# prompt_toolkit_ext 的导入时间最多为 prompt_toolkit 的这个比例
+MAX_RATIO = 0.5
+RUNS = 5
+
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def _cumulative_ms(stderr: str, module: str) -> float:
+    # import time: self [us] | cumulative | imported package
+    for line in stderr.splitlines():
+        fields = [f.strip() for f in line.partition(':')[2].split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e3
+    raise AssertionError('no import time reported for %s' % module)
+
+
+def _best_import_ms(module: str) -> float:
+    # 取最小值，排除第一次编译 .pyc 和系统负载的影响
+    return min(_cumulative_ms(_run('import %s' % module).stderr, module) for _ in range(RUNS))
+
+
+def test_no_heavy_modules():
+    code = ('import sys, prompt_toolkit_ext; '
+            'print(" ".join(m for m in sys.modules if m.split(".")[0] in %r))' % (HEAVY_MODULES,))
+    loaded = _run(code).stdout.split()
+    assert not loaded, 'heavy modules imported: %s' % ', '.join(loaded)
+
+
+def test_import_time_relative_to_prompt_toolkit():
+    package_ms = _best_import_ms('prompt_toolkit_ext')
+    prompt_toolkit_ms = _best_import_ms('prompt_toolkit')
+    assert package_ms <= prompt_toolkit_ms * MAX_RATIO, \
+        'import prompt_toolkit_ext took %.1fms, prompt_toolkit %.1fms' % (package_ms, prompt_toolkit_ms)